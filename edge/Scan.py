@@ -2,7 +2,9 @@ import sys
 import os
 import warnings
 import time
+import json
 import numpy as np
+import yaml
 warnings.filterwarnings("ignore", category=SyntaxWarning)
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -10,19 +12,141 @@ BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 if BASE_DIR not in sys.path:
     sys.path.insert(0, BASE_DIR)
 
-from edge.printer_control import Printer
-from edge.camera_control import Camera
+from edge.drivers import create_camera, create_printer
+from edge.scan_journal import ScanJournal
 from utils import config
 
-def main():
-    printer = Printer()
-    camera = Camera()
+CONFIG_PATH = os.path.join(BASE_DIR, 'edge', 'config.yaml')
+POSITION_TOLERANCE_MM = 0.05
+
+def scan_positions(start_x, end_x, step_x, start_z, end_z, step_z):
+    """All scan stops in serpentine order, as (index, x, z)."""
+    positions = []
+    direction = 1
+    for z in np.arange(start_z, end_z + 0.001, step_z):
+        x_positions = (
+            np.arange(start_x, end_x + 0.001, step_x)
+            if direction == 1
+            else np.arange(end_x, start_x - 0.001, -step_x)
+        )
+        for x in x_positions:
+            positions.append((len(positions), float(x), float(z)))
+        direction *= -1
+    return positions
+
+def scan_folder_name():
+    """Name of a new scan folder, e.g. scan_30April_17:40:21."""
+    return time.strftime("scan_%d%B_%H:%M:%S")
+
+def frame_name(x, z):
+    return f"X{int(x*10):03}_Z{int(z*10):03}.png"
+
+def run_batched(printer, camera, scan_folder, stops, journal, progress=None, total=None):
+    """
+    Capture a run of stops from one streamed G-code program (see
+    Printer.compile_program). At each stop a fresh frame is grabbed, with the
+    camera's queued frames dropped, so it is exposed while the printer
+    dwells; frames are corrected and written once the program has finished.
+
+    A capture that outlasts the dwell or a stop reported off position is
+    dropped, so it stays out of the journal and is retaken in step mode.
+    """
+    expected = {i: (x, z) for i, x, z in stops}
+    dwell_s = printer.capture_dwell_ms / 1000.0
+    captured = []
+
+    def on_stop(i, x, z):
+        start = time.time()
+        cropped = camera.crop_roi(camera.capture_frame(fresh=True)).copy()
+        want_x, want_z = expected[i]
+        if abs(x - want_x) > POSITION_TOLERANCE_MM or abs(z - want_z) > POSITION_TOLERANCE_MM:
+            print(f"[WARNING] Stop {i} reported at X={x:.2f}, Z={z:.2f}; retaking it in step mode.")
+        elif time.time() - start > dwell_s:
+            print(f"[WARNING] Capture at stop {i} outlasted the {printer.capture_dwell_ms} ms dwell; "
+                  f"retaking it in step mode.")
+        else:
+            captured.append((i, cropped))
+
+    printer.run_program(printer.compile_program(stops), on_stop)
+
+    for i, cropped in captured:
+        x, z = expected[i]
+        written = camera.store_frame(cropped, os.path.join(scan_folder, frame_name(x, z)))
+        journal.record(i, x, z, written)
+        if progress:
+            progress(journal.frames_written, total)
+    # Committed runs are what the step-mode pass checks for dropped captures
+    journal.commit()
+
+def run_scan(printer, camera, scan_folder, positions, journal, progress=None):
+    """
+    Capture every position not yet in the journal, in runs of
+    `printer.batch_stops` streamed stops if set, otherwise one move per stop.
+    """
+    # The first frame after a (re)start must not depend on uncommitted frames
+    camera.encoder.reset()
+    total = len(positions)
+
+    if printer.batch_stops:
+        todo = [p for p in positions if not journal.is_done(p[0])]
+        for start in range(0, len(todo), printer.batch_stops):
+            run_batched(printer, camera, scan_folder, todo[start:start + printer.batch_stops],
+                        journal, progress, total)
+
+    # Step mode; after batched runs this only retakes dropped captures
+    current_z = None
+
+    for i, x, z in positions:
+        if journal.is_done(i):
+            continue
+
+        if z != current_z:
+            printer.move_to(z=z)
+            time.sleep(config.PAUSE_AFTER_MOVE)
+            current_z = z
+
+        print(f"Capturing frame at X={x:.2f} mm, Z={z:.2f} mm")
+        printer.move_to(x=x)
+        time.sleep(config.PAUSE_AFTER_MOVE)
+
+        written = camera.save_frame(os.path.join(scan_folder, frame_name(x, z)))
+        journal.record(i, x, z, written)
+
+        if progress:
+            progress(journal.frames_written, total)
+
+    journal.commit()
+
+def reconnect(printer, camera):
+    """Reopen serial and camera after a failure; the printer is re-homed since its position is unknown."""
+    camera.disconnect()
+    printer.disconnect()
+    printer.connect()
+    if not printer.serial:
+        raise Exception("Printer reconnection failed.")
+    camera.connect()
+    printer.home()
+
+def main(progress=None, resume_folder=None, data_dir=None):
+    """
+    Run a full 2D scan. `progress(done, total)` is called after every frame.
+    With `resume_folder`, continue an interrupted scan from its journal.
+    New scan folders go to `data_dir` (default ./data).
+
+    Returns:
+        the scan folder on success, None if the scan failed
+    """
+    with open(CONFIG_PATH, 'r') as f:
+        full_config = yaml.safe_load(f)
+    printer = create_printer(full_config["printer"])
+    camera = create_camera(full_config["camera"])
+    journal = None
 
     try:
         printer.connect()
         if not printer.serial:
             print("Printer connection failed. Exiting.")
-            return
+            return None
 
         camera.connect()
 
@@ -36,50 +160,63 @@ def main():
         end_z = config.SCAN_END_Z
         step_size_x = config.STEP_SIZE_X
         step_size_z = config.STEP_SIZE_Z
-
-        # Create a scan folder
-        scan_time = time.strftime("%d%B_%H:%M:%S")
-        scan_folder = os.path.join(os.getcwd(), "data", f"scan_{scan_time}")
-        os.makedirs(scan_folder, exist_ok=True)
+        scan_config = {
+            "SCAN_START_X": start_x, "SCAN_END_X": end_x, "STEP_SIZE_X": step_size_x,
+            "SCAN_START_Z": start_z, "SCAN_END_Z": end_z, "STEP_SIZE_Z": step_size_z,
+            # What the camera actually runs with, i.e. config.yaml rather than utils/config.py
+            "EXPOSURE_TIME_MS": full_config["camera"]["EXPOSURE_TIME_MS"],
+            "MASTER_GAIN": full_config["camera"]["MASTER_GAIN"],
+        }
+
+        # Create a scan folder (or reuse the interrupted one)
+        if resume_folder:
+            scan_folder = os.path.abspath(resume_folder)
+        else:
+            scan_folder = os.path.join(data_dir or os.path.join(os.getcwd(), "data"), scan_folder_name())
+            os.makedirs(scan_folder, exist_ok=True)
         print(f"Saving scan data to: {scan_folder}")
 
-        # Move to starting point
-        printer.move_to(x=start_x, z=start_z)
-        time.sleep(config.PAUSE_AFTER_MOVE)
-
-        print("Starting full 2D scan...")
-        direction = 1
-
-        for z in np.arange(start_z, end_z + 0.001, step_size_z):
-            printer.move_to(z=z)
-            time.sleep(config.PAUSE_AFTER_MOVE)
+        # Scan metadata for the server-side scan catalog
+        with open(os.path.join(scan_folder, "scan_meta.json"), "w") as f:
+            json.dump({
+                "config": scan_config,
+                "calibration": dict(zip(("red_band", "green_band", "blue_band"), config.load_rgb_bands())),
+                "wavelengths": camera.band_wavelengths(),
+            }, f, indent=2)
 
-            x_positions = (
-                np.arange(start_x, end_x + 0.001, step_size_x)
-                if direction == 1
-                else np.arange(end_x, start_x - 0.001, -step_size_x)
-            )
+        journal = ScanJournal(scan_folder, fsync_every=config.JOURNAL_FSYNC_EVERY).open(scan_config)
+        positions = scan_positions(start_x, end_x, step_size_x, start_z, end_z, step_size_z)
 
-            for x in x_positions:
-                print(f"Capturing frame at X={x:.2f} mm, Z={z:.2f} mm")
-                printer.move_to(x=x)
-                time.sleep(config.PAUSE_AFTER_MOVE)
-
-                filename = f"X{int(x*10):03}_Z{int(z*10):03}.png"
-                full_path = os.path.join(scan_folder, filename)
-                camera.save_frame(full_path)
-
-            direction *= -1
+        print("Starting full 2D scan...")
+        for attempt in range(config.MAX_SCAN_RETRIES + 1):
+            try:
+                run_scan(printer, camera, scan_folder, positions, journal, progress)
+                break
+            except Exception as e:
+                journal.commit()
+                if attempt == config.MAX_SCAN_RETRIES:
+                    raise
+                print(f"Error during scanning: {e} — resuming from position "
+                      f"{len(journal.completed)}/{len(positions)} "
+                      f"(retry {attempt + 1}/{config.MAX_SCAN_RETRIES})")
+                reconnect(printer, camera)
 
         print("Full 2D scan completed successfully.")
+        return scan_folder
 
     except Exception as e:
         print(f"Error during scanning: {e}")
+        return None
 
     finally:
+        if journal:
+            journal.close()
         camera.disconnect()
         printer.disconnect()
 
 if __name__ == "__main__":
-    main()
-
+    # python edge/Scan.py [--resume data/scan_<time>]
+    if len(sys.argv) > 2 and sys.argv[1] == "--resume":
+        main(resume_folder=sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,108 @@
+import sys
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from utils.frame_codec import ENCODERS, get_encoder, read_frame, write_frame
+
+# ----------------------------------------------------------------
+#  Frame codec micro-benchmark
+# ----------------------------------------------------------------
+# Encodes a sequence of line frames with every available codec and reports
+# encode time per frame, size and compression ratio. Run it on the edge
+# device itself, with real frames if possible:
+#
+#   python edge/benchmark_codecs.py data/scan_*/X*_Z0*.png
+#
+# Without arguments, synthetic 12-bit frames shaped like the binned sensor
+# output are used.
+
+CODEC_VARIANTS = [
+    ("raw", {}),
+    ("png", {"level": 0}),
+    ("png", {"level": 1}),
+    ("png", {"level": 3}),
+    ("png", {"level": 6}),
+    ("tiff", {"lzw": False}),
+    ("tiff", {"lzw": True}),
+    ("delta-lz4", {"level": 0}),
+    ("delta-zstd", {"level": 1}),
+    ("delta-zstd", {"level": 3}),
+]
+
+
+def synthetic_frames(n_frames=32, rows=555, bands=1024, bits=12, seed=0):
+    """Smooth spectra x spatial profile that drifts slowly along the scan, plus shot noise."""
+    rng = np.random.default_rng(seed)
+    wl = np.linspace(0.0, 1.0, bands)
+    spectrum = 0.3 + 0.5 * np.exp(-((wl - 0.6) / 0.15) ** 2) + 0.2 * np.exp(-((wl - 0.25) / 0.05) ** 2)
+    y = np.linspace(0.0, 1.0, rows)[:, None]
+    full_scale = 2 ** bits - 1
+
+    frames = []
+    for i in range(n_frames):
+        profile = 0.6 + 0.4 * np.sin(2 * np.pi * (y * 3 + i * 0.01))
+        signal = profile * spectrum[None, :] * full_scale * 0.8
+        frames.append(np.clip(rng.poisson(signal), 0, full_scale).astype(np.uint16))
+    return frames
+
+
+def benchmark(frames, variants=CODEC_VARIANTS, verify=True):
+    raw_bytes = sum(f.nbytes for f in frames)
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, options in variants:
+            try:
+                encoder = get_encoder(name, **options)
+            except ImportError as e:
+                print(f"[SKIP] {name}: {e}")
+                continue
+
+            paths = []
+            start = time.perf_counter()
+            for i, frame in enumerate(frames):
+                paths.append(write_frame(os.path.join(tmp, f"frame_{i:04}"), frame, encoder))
+            elapsed = time.perf_counter() - start
+
+            size = sum(os.path.getsize(p) for p in paths)
+            if verify:
+                cache = {}
+                for frame, path in zip(frames, paths):
+                    if not np.array_equal(read_frame(path, cache), frame):
+                        raise RuntimeError(f"{name} {options} is not lossless")
+
+            label = name + ("" if not options else " " + ",".join(f"{k}={v}" for k, v in options.items()))
+            results.append((label, elapsed / len(frames) * 1000, size, raw_bytes / size))
+            for p in paths:
+                os.remove(p)
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare frame codecs on speed and size.")
+    parser.add_argument("frames", nargs="*", help="Frame files to use (default: synthetic 12-bit frames)")
+    parser.add_argument("--count", type=int, default=32, help="Number of synthetic frames")
+    args = parser.parse_args(argv)
+
+    if args.frames:
+        cache = {}
+        frames = [read_frame(p, cache) for p in sorted(args.frames)]
+    else:
+        frames = synthetic_frames(args.count)
+
+    print(f"{len(frames)} frames, {frames[0].shape} {frames[0].dtype}, codecs: {', '.join(ENCODERS)}\n")
+    print(f"{'codec':<24}{'ms/frame':>10}{'total KiB':>12}{'ratio':>8}")
+    for label, ms, size, ratio in benchmark(frames):
+        print(f"{label:<24}{ms:>10.2f}{size / 1024:>12.0f}{ratio:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,6 @@
 import sys
 import os
 import numpy as np
-import cv2
-from ids_peak import ids_peak
 import ctypes
 
 
@@ -10,11 +8,23 @@ BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 if BASE_DIR not in sys.path:
     sys.path.insert(0, BASE_DIR)
 
+from utils.smile import load_smile_corrector
+from utils.frame_codec import encoder_from_config, get_encoder, write_frame
+
+# The IDS peak SDK is slow to import; load it on first connect
+ids_peak = None
+
+def _load_sdk():
+    global ids_peak
+    if ids_peak is None:
+        from ids_peak import ids_peak as sdk
+        ids_peak = sdk
+    return ids_peak
+
 class Camera:
     def __init__(self, camera_cfg):
         self.update_config(camera_cfg)
-        ids_peak.Library.Initialize()
-        self.device_manager = ids_peak.DeviceManager.Instance()
+        self.device_manager = None
         self.device = None
         self.datastream = None
         self.nodemap = None
@@ -27,10 +37,24 @@ class Camera:
         self.height = camera_cfg["CAMERA_HEIGHT"]
         self.data_dir = camera_cfg["DATA_DIR"]
         self.binning_factor = camera_cfg.get("BINNING_FACTOR", 2)
+        self.bits_per_pixel = camera_cfg.get("BITS_PER_PIXEL", 8)
+        self.encoder = encoder_from_config(camera_cfg)
         self.roi_top = 248
         self.roi_bottom = 803
 
+        # Optional smile/keystone correction, weights are precomputed at calibration time
+        smile_file = camera_cfg.get("SMILE_CALIBRATION")
+        if smile_file:
+            smile_file = os.path.join(BASE_DIR, smile_file)
+        self.smile = load_smile_corrector(smile_file)
+        if smile_file and self.smile is None:
+            print(f"[WARNING] Smile calibration not found at {smile_file} — frames left uncorrected.")
+
     def connect(self):
+        # Initialized per connection, since disconnect() closes the library
+        _load_sdk()
+        ids_peak.Library.Initialize()
+        self.device_manager = ids_peak.DeviceManager.Instance()
         self.device_manager.Update()
         if self.device_manager.Devices().empty():
             raise Exception("No camera found!")
@@ -45,9 +69,13 @@ class Camera:
         self.nodemap.FindNode("ExposureTime").SetValue(self.exposure_time)
         self.nodemap.FindNode("Gain").SetValue(self.gain)
 
+        # Mono12 is delivered unpacked, one uint16 per pixel
+        pixel_format = "Mono12" if self.bits_per_pixel > 8 else "Mono8"
+        self.nodemap.FindNode("PixelFormat").SetCurrentEntry(pixel_format)
+
         width = int(self.nodemap.FindNode("Width").Value())
         height = int(self.nodemap.FindNode("Height").Value())
-        bpp = 1  # Mono8 pixel
+        bpp = 2 if self.bits_per_pixel > 8 else 1
         payload_size = width * height * bpp
 
         print(f"[INFO] Config: Exposure={self.exposure_time} µs Gain={self.gain} → Frame {width}x{height}")
@@ -67,17 +95,30 @@ class Camera:
         self.initialized = True
         print("[INFO] Acquisition started — ready to capture.\n")
 
-    def capture_frame(self):
+    def flush(self):
+        """Return finished but unread buffers to the acquisition queue."""
+        self.datastream.Flush(ids_peak.DataStreamFlushMode_AllToInputPool)
+
+    def capture_frame(self, fresh=False):
+        """
+        Parameters:
+            fresh: drop the queued frames and the one being exposed, so the
+                returned frame is exposed entirely after the call
+        """
         if not self.initialized:
             raise Exception("Camera not initialized!")
 
+        if fresh:
+            self.flush()
+            self.datastream.QueueBuffer(self.datastream.WaitForFinishedBuffer(5000))
+
         buffer = self.datastream.WaitForFinishedBuffer(5000)
         width = buffer.Width()
         height = buffer.Height()
 
-        import ctypes
         buf_ptr = int(buffer.BasePtr())  # Correctly convert to int!
-        ptr = ctypes.cast(buf_ptr, ctypes.POINTER(ctypes.c_ubyte))
+        c_pixel = ctypes.c_uint16 if self.bits_per_pixel > 8 else ctypes.c_ubyte
+        ptr = ctypes.cast(buf_ptr, ctypes.POINTER(c_pixel))
         img_array = np.ctypeslib.as_array(ptr, shape=(height, width))
         img_copy = np.copy(img_array)
 
@@ -94,26 +135,57 @@ class Camera:
         new_w = w // factor
         image = image[:, :new_w * factor]  # Trim width to multiple of factor
         binned = image.reshape(h, new_w, factor).mean(axis=2)
-        return binned.astype(np.uint8)
+        return np.rint(binned).astype(image.dtype)
+
 
+    def band_wavelengths(self):
+        """Centre wavelength (nm) of each saved band, or None without a smile calibration."""
+        if self.smile is None:
+            return None
+        factor = self.binning_factor
+        wl = self.smile.target_wavelengths
+        n = wl.shape[0] // factor
+        return [round(float(w), 3) for w in wl[:n * factor].reshape(n, factor).mean(axis=1)]
 
     def crop_roi(self, image):
         return image[self.roi_top:self.roi_bottom, :]
 
-    def save_frame(self, file_name="debug_picture.png"):
-        frame = self.capture_frame()
-        cropped = self.crop_roi(frame)
-        binned = self.bin_image(cropped)
+    def correct_smile(self, image):
+        if self.smile is None:
+            return image
+        return self.smile.apply(image)
+
+    def save_frame(self, file_name="debug_picture.png", encoder=None):
+        """Capture, correct and bin a frame and write it. Returns the written path."""
+        return self.store_frame(self.crop_roi(self.capture_frame()), file_name, encoder)
+
+    def save_preview(self, file_name="debug_picture.png"):
+        """
+        Capture a frame and write it as an 8-bit PNG for the dashboard, scaled
+        down from BITS_PER_PIXEL so 12-bit frames are not shown 16x too dark.
+        Returns the written path.
+        """
+        return self.store_frame(self.crop_roi(self.capture_frame()), file_name, get_encoder("png"), eight_bit=True)
+
+    def store_frame(self, cropped, file_name, encoder=None, eight_bit=False):
+        """
+        Correct, bin and write an already captured and cropped frame, so
+        processing can be deferred until the printer is moving again.
+        Returns the written path.
+        """
+        corrected = self.correct_smile(cropped)
+        binned = self.bin_image(corrected)
+        if eight_bit and self.bits_per_pixel > 8:
+            binned = (binned >> (self.bits_per_pixel - 8)).astype(np.uint8)
 
         out_dir = os.path.abspath(os.path.join(BASE_DIR, self.data_dir))
         os.makedirs(out_dir, exist_ok=True)
 
-        output_path = os.path.join(out_dir, f"{file_name}")
-        cv2.imwrite(output_path, binned)
+        output_path = write_frame(os.path.join(out_dir, f"{file_name}"), binned, encoder or self.encoder)
         print(f"[INFO] Final saved frame shape: {cropped.shape} → binned shape: {binned.shape}")
 
-
-        os.sync()
+        # Durability is handled by the caller (see edge/scan_journal.py)
+        return output_path
 
 
     def disconnect(self):
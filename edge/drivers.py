@@ -0,0 +1,50 @@
+import importlib
+
+# ----------------------------------------------------------------
+#  Hardware driver registry
+# ----------------------------------------------------------------
+# Drivers are registered as "module:Class" strings and only imported when
+# an instance is created, so the MQTT daemon can start and reach the broker
+# without loading camera SDKs, OpenCV or pyserial. The driver is selected by
+# the DRIVER key of the camera/printer section in config.yaml.
+
+CAMERA_DRIVERS = {
+    "ids_peak": "edge.camera_control:Camera",
+}
+
+PRINTER_DRIVERS = {
+    "marlin": "edge.printer_control:Printer",
+}
+
+DEFAULT_CAMERA_DRIVER = "ids_peak"
+DEFAULT_PRINTER_DRIVER = "marlin"
+
+
+def register_camera_driver(name, target):
+    """Register a camera driver as "module:Class" (or the class itself)."""
+    CAMERA_DRIVERS[name] = target
+
+
+def register_printer_driver(name, target):
+    """Register a printer driver as "module:Class" (or the class itself)."""
+    PRINTER_DRIVERS[name] = target
+
+
+def load_driver(registry, name):
+    try:
+        target = registry[name]
+    except KeyError:
+        raise ValueError(f"Unknown driver '{name}', expected one of {sorted(registry)}")
+    if isinstance(target, str):
+        module_name, class_name = target.split(":")
+        target = getattr(importlib.import_module(module_name), class_name)
+        registry[name] = target
+    return target
+
+
+def create_camera(camera_cfg):
+    return load_driver(CAMERA_DRIVERS, camera_cfg.get("DRIVER", DEFAULT_CAMERA_DRIVER))(camera_cfg)
+
+
+def create_printer(printer_cfg):
+    return load_driver(PRINTER_DRIVERS, printer_cfg.get("DRIVER", DEFAULT_PRINTER_DRIVER))(printer_cfg)
@@ -6,19 +6,23 @@ import time
 import datetime
 import glob
 import subprocess
+import threading
 
 import paho.mqtt.client as mqtt
-import cv2
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 if BASE_DIR not in sys.path:
     sys.path.insert(0, BASE_DIR)
 
-from camera_control import Camera
-from printer_control import Printer
+from drivers import create_camera, create_printer
+from status_publisher import StatusPublisher
+from topics import rig_topics, tarball_name
 
 CONFIG_PATH = os.path.join(BASE_DIR, 'edge', 'config.yaml')
 
+# Status fields that belong to one job and are cleared when the next one starts
+JOB_FIELDS = ("job_id", "error", "scan_tarball")
+
 def load_config():
     with open(CONFIG_PATH, 'r') as f:
         return yaml.safe_load(f)
@@ -30,11 +34,20 @@ class HSI_MQTT:
 
         self.broker = self.config["mqtt"]["broker"]
         self.port = self.config["mqtt"]["port"]
-        self.topics = self.config["mqtt"]["topics"]
-
-        # Initialize camera and printer with initial config (can be reloaded later)
-        self.printer = Printer(self.config["printer"])
-        self.cam = Camera(self.config["camera"])
+        self.rig_id = self.config["mqtt"].get("rig_id", "hs_scanner")
+        # Topics derive from rig_id; a `topics` section in config.yaml only overrides single entries
+        self.topics = dict(rig_topics(self.rig_id), **self.config["mqtt"].get("topics", {}))
+        self.status = StatusPublisher(
+            self.client,
+            rate_hz=self.config["mqtt"].get("status_rate_hz", 2.0),
+            snapshot_interval=self.config["mqtt"].get("status_snapshot_s", 60.0),
+        )
+
+        # Camera and printer drivers (and their SDKs) are loaded on first use,
+        # so the daemon is on the broker before any hardware module is imported
+        self.printer = None
+        self.cam = None
+        self._scan_thread = None
 
     def connect(self):
         self.client.on_connect = self.on_connect
@@ -44,6 +57,7 @@ class HSI_MQTT:
         self.client.connect(self.broker, self.port, 60)
 
         self.client.loop_start()
+        self.status.start()
 
     def on_connect(self, client, userdata, flags, rc):
         print("Connected to MQTT broker.")
@@ -52,11 +66,16 @@ class HSI_MQTT:
         self.client.subscribe(self.topics["printer_gcode"])
         self.client.subscribe(self.topics["config_request"])
 
-        # Publish current config once on connect
-        self.publish_status({"config": self.config})
-        self.publish_camera_status()
-        self.publish_printer_status()
-        print("Published current config on connect.\n")
+        # Announce this rig (and its topics) for server-side discovery
+        self.status.update(self.topics["announce"], {"rig_id": self.rig_id, "topics": self.topics},
+                           snapshot=True)
+
+        # Retained full snapshots on (re)connect
+        self.publish_status({"status": "scanning" if self.scan_running() else "idle", "config": self.config},
+                            snapshot=True)
+        self.publish_camera_status(snapshot=True)
+        self.publish_printer_status(snapshot=True)
+        print("Queued current config on connect.\n")
 
     def on_message(self, client, userdata, msg):
         topic = msg.topic
@@ -79,31 +98,46 @@ class HSI_MQTT:
                 print(f"Deleting old scan folder: {old_scan}")
                 subprocess.run(["rm", "-rf", old_scan])
 
-        tarballs = glob.glob(os.path.join(data_dir, "scan_*.tar.gz"))
+        tarballs = glob.glob(os.path.join(data_dir, tarball_name(self.rig_id, "scan_*")))
         for tb in tarballs:
             os.remove(tb)
 
+    def scan_running(self):
+        return self._scan_thread is not None and self._scan_thread.is_alive()
+
     def handle_scan_command(self, payload):
-        print("Starting FAKE scan routine (re-using previous scan folder)...\n")
-        self.publish_status({"status": "scanning"})
+        job_id = payload.get("job_id")
+        if self.scan_running():
+            print("[WARNING] A scan is already running, ignoring scan command.\n")
+            self.publish_scan_result(job_id, "rejected", error="scan already running")
+            return
+
+        # The scan runs for minutes; keep the MQTT network loop free meanwhile
+        self._scan_thread = threading.Thread(target=self.run_scan, args=(job_id,), daemon=True)
+        self._scan_thread.start()
+
+    def run_scan(self, job_id):
+        print("Starting scan routine...\n")
+        self.publish_status({"status": "scanning", "job_id": job_id}, drop=JOB_FIELDS)
 
         try:
+            import Scan  # loads the hardware drivers, only needed once a scan is requested
+
             config = load_config()
             ssh_cfg = config["ssh"]
 
-            # Path PREVIOUS scan folder
-            reuse_scan_name = "scan_30April_17:40:21"
-            reuse_scan_dir = os.path.join(BASE_DIR, "data", reuse_scan_name)
-
-            if not os.path.exists(reuse_scan_dir):
-                raise Exception(f"Cannot find {reuse_scan_dir} — did you delete it?")
-
-            print(f"Using existing scan folder: {reuse_scan_dir}")
+            scan_dir = Scan.main(
+                progress=lambda done, total: self.publish_scan_progress(done, total, job_id=job_id),
+                data_dir=os.path.join(BASE_DIR, "data"),
+            )
+            if scan_dir is None:
+                raise Exception("Scan failed, see log above.")
+            scan_name = os.path.basename(scan_dir)
 
-            # Tarball output for upload (optional — or you can SCP the folder directly)
-            tarball = f"{reuse_scan_dir}.tar.gz"
+            # Tarball output for upload
+            tarball = os.path.join(os.path.dirname(scan_dir), tarball_name(self.rig_id, scan_name))
             subprocess.run(
-                ["tar", "-czf", tarball, "-C", os.path.dirname(reuse_scan_dir), reuse_scan_name],
+                ["tar", "-czf", tarball, "-C", os.path.dirname(scan_dir), scan_name],
                 check=True
             )
             print(f"Created tarball: {tarball}\n")
@@ -120,15 +154,21 @@ class HSI_MQTT:
 
             self.publish_status({
                 "status": "idle",
+                "job_id": job_id,
                 "scan_tarball": tarball
             })
+            self.publish_scan_result(job_id, "done", scan_tarball=tarball)
 
         except Exception as e:
-            print(f"[ERROR] Fake scan push failed: {e}\n")
-            self.publish_status({"status": "error"})
-
+            print(f"[ERROR] Scan failed: {e}\n")
+            self.publish_status({"status": "error", "job_id": job_id, "error": str(e)})
+            self.publish_scan_result(job_id, "failed", error=str(e))
 
     def handle_camera_picture(self, payload):
+        # The scan owns the camera; a second connection would close the SDK under it
+        if self.scan_running():
+            print("[WARNING] A scan is running, ignoring camera picture request.\n")
+            return
         print("Taking debug camera picture...")
 
         config = load_config()
@@ -149,9 +189,9 @@ class HSI_MQTT:
 
         try:
             # Try the real camera
-            self.cam = Camera(camera_cfg)
+            self.cam = create_camera(camera_cfg)
             self.cam.connect()
-            self.cam.save_frame(file_name=output_name)
+            self.cam.save_preview(file_name=output_name)
             self.cam.disconnect()
             print(f"Camera capture saved at {local_picture}\n")
 
@@ -177,11 +217,15 @@ class HSI_MQTT:
             self.publish_status({"status": "error"})
 
     def handle_printer_gcode(self, payload):
+        # The scan owns the serial port
+        if self.scan_running():
+            print("[WARNING] A scan is running, ignoring printer GCode request.\n")
+            return
         print("Running printer GCode...\n")
         try:
             config = load_config()
             printer_cfg = config["printer"]
-            self.printer = Printer(printer_cfg)
+            self.printer = create_printer(printer_cfg)
 
             cmd = payload.get("gcode")
             if not cmd:
@@ -216,9 +260,9 @@ class HSI_MQTT:
 
             with open(CONFIG_PATH, 'w') as f:
                 yaml.dump(config, f)
+            self.config = config
 
             print("Config updated.\n")
-            self.publish_status({"config": "updated"})
             self.publish_status({"config": self.config})
             self.publish_camera_status()
             self.publish_printer_status()
@@ -227,25 +271,37 @@ class HSI_MQTT:
             print(f"Config update error: {e}")
             self.publish_status({"status": "error"})
 
-    def publish_status(self, extra={}):
-        data = {"status": extra.get("status", "idle")}
-        data.update(extra)
-        self.client.publish(self.topics["status"], json.dumps(data))
-        print(f"Published scanner status: {data}\n")
+    def publish_status(self, extra={}, snapshot=False, drop=()):
+        """Merge `extra` into the rig status; fields in `drop` are removed first."""
+        self.status.update(self.topics["status"], dict(extra), snapshot=snapshot, drop=drop)
 
-    def publish_camera_status(self, extra={}):
+    def publish_camera_status(self, extra={}, snapshot=False):
         data = {"status": extra.get("status", "idle")}
-        data.update(load_config()["camera"])
+        data.update(self.config["camera"])
         data.update(extra)
-        self.client.publish(self.topics["camera_status"], json.dumps(data))
-        print(f"Published camera status: {data}\n")
+        self.status.update(self.topics["camera_status"], data, snapshot=snapshot)
 
-    def publish_printer_status(self, extra={}):
+    def publish_printer_status(self, extra={}, snapshot=False):
         data = {"status": extra.get("status", "idle")}
-        data.update(load_config()["printer"])
+        data.update(self.config["printer"])
         data.update(extra)
-        self.client.publish(self.topics["printer_status"], json.dumps(data))
-        print(f"Published printer status: {data}\n")
+        self.status.update(self.topics["printer_status"], data, snapshot=snapshot)
+
+    def publish_scan_progress(self, done, total, **extra):
+        """Per-frame progress callback for the scan loop (non-blocking)."""
+        topic = self.topics.get("scan_progress", self.topics["status"])
+        self.status.progress(topic, done, total, **extra)
+
+    def publish_scan_result(self, job_id, result, **fields):
+        """
+        Outcome of one scan command ("done", "failed" or "rejected"). Sent
+        directly rather than through the status publisher, so results are
+        never coalesced or reduced to deltas; the orchestrator finishes jobs
+        from these messages only.
+        """
+        data = dict(fields, job_id=job_id, result=result)
+        self.client.publish(self.topics["scan_result"], json.dumps(data), qos=1)
+        print(f"Published scan result: {data}\n")
 
     def loop_forever(self):
         try:
@@ -253,6 +309,7 @@ class HSI_MQTT:
                 time.sleep(1)
         except KeyboardInterrupt:
             print("Stopping MQTT client...\n")
+            self.status.stop()
             self.client.loop_stop()
             self.client.disconnect()
 
@@ -1,12 +1,29 @@
 import sys
 import os
-import serial
+import re
 import time
+from collections import deque
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 if BASE_DIR not in sys.path:
     sys.path.insert(0, BASE_DIR)
 
+# pyserial is imported on first connect
+serial = None
+
+def _load_serial():
+    global serial
+    if serial is None:
+        import serial as pyserial
+        serial = pyserial
+    return serial
+
+# Row programs: M118 echoes "<SYNC_MARKER> <index>" when the printer reaches a
+# stop, followed by the M114 position report the capture is triggered on
+SYNC_MARKER = "KFS_STOP"
+SYNC_PATTERN = re.compile(SYNC_MARKER + r" (\d+)")
+POSITION_PATTERN = re.compile(r"X:(-?[\d.]+)\s+Y:(-?[\d.]+)\s+Z:(-?[\d.]+)")
+
 class Printer:
     def __init__(self, printer_cfg):
         """Initialize printer with config dictionary."""
@@ -21,8 +38,15 @@ class Printer:
         self.steps_per_mm = printer_cfg.get("STEPS_PER_MM", 80)
         self.extruder_temp = printer_cfg.get("EXTRUDER_TEMP", 200)
         self.default_feedrate = printer_cfg.get("DEFAULT_FEEDRATE", 1200)  # Added
+        self.move_timeout = printer_cfg.get("MOVE_TIMEOUT", 60)  # seconds for a move (M400) to finish
+        # Batched row programs (0 stops = one move_to round trip per stop)
+        self.batch_stops = printer_cfg.get("BATCH_STOPS", 0)
+        self.settle_ms = printer_cfg.get("SETTLE_MS", 500)
+        self.capture_dwell_ms = printer_cfg.get("CAPTURE_DWELL_MS", 300)
+        self.stream_window = printer_cfg.get("STREAM_WINDOW", 4)
 
     def connect(self):
+        _load_serial()
         try:
             self.serial = serial.Serial(self.device, self.baudrate, timeout=self.timeout)
             time.sleep(2)
@@ -87,36 +111,40 @@ class Printer:
             self.serial = None
 
     def send_gcode(self, cmd, wait=False):
-        if self.serial:
-            try:
-                print(f"\nSending: {cmd}")
-                self.serial.write((cmd + '\n').encode())
+        """
+        Send one command and wait for its "ok"; with `wait`, also wait for the
+        move to finish (M400). Raises on serial errors and timeouts, so a scan
+        can reconnect and resume instead of capturing at an unknown position.
+        """
+        if not self.serial:
+            raise Exception("Serial connection not established")
+        _load_serial()
+
+        try:
+            print(f"\nSending: {cmd}")
+            self.serial.write((cmd + '\n').encode())
+            time.sleep(0.1)
+            self._wait_ok(10, f"Printer did not acknowledge '{cmd}'.")
+
+            if wait:
+                self.serial.write(b'M400\n')
                 time.sleep(0.1)
+                self._wait_ok(self.move_timeout, f"Printer did not finish '{cmd}' within {self.move_timeout} s.",
+                              label="Wait M400 response")
 
-                start_time = time.time()
-                while time.time() - start_time < 10:
-                    response = self.serial.readline().decode(errors='ignore').strip()
-                    if response:
-                        if not response.startswith("echo:busy"):
-                            print(f"Response: {response}")
-                        if "ok" in response.lower():
-                            break
-
-                if wait:
-                    self.serial.write(b'M400\n')
-                    time.sleep(0.1)
-                    while True:
-                        response = self.serial.readline().decode(errors='ignore').strip()
-                        if response:
-                            if not response.startswith("echo:busy"):
-                                print(f"Wait M400 response: {response}")
-                            if "ok" in response.lower():
-                                break
-
-            except serial.SerialException as e:
-                print(f"Serial error: {e}")
-        else:
-            raise Exception("Serial connection not established")
+        except serial.SerialException as e:
+            raise Exception(f"Serial error: {e}") from e
+
+    def _wait_ok(self, timeout, message, label="Response"):
+        start_time = time.time()
+        while time.time() - start_time < timeout:
+            response = self.serial.readline().decode(errors='ignore').strip()
+            if response:
+                if not response.startswith("echo:busy"):
+                    print(f"{label}: {response}")
+                if "ok" in response.lower():
+                    return
+        raise Exception(message)
 
     def wait_until_ready(self, timeout=10):
         if not self.serial:
@@ -149,6 +177,82 @@ class Printer:
         cmd += f" F{feedrate}"
         self.send_gcode(cmd, wait=True)
 
+    # ------------------------------------------------------------
+    #  Batched row programs
+    # ------------------------------------------------------------
+    def compile_program(self, stops, feedrate=None):
+        """
+        Compile a run of scan stops into one G-code program for run_program().
+
+        Every stop moves, waits for the move to finish (M400), settles (G4),
+        emits a sync marker (M118) and a position report (M114), then dwells
+        while the host captures the frame.
+
+        Parameters:
+            stops: list of (index, x, z)
+
+        Returns:
+            list of G-code lines
+        """
+        if feedrate is None:
+            feedrate = self.default_feedrate
+
+        lines = []
+        for index, x, z in stops:
+            lines += [f"G1 X{x:.3f} Z{z:.3f} F{feedrate}", "M400"]
+            if self.settle_ms:
+                lines.append(f"G4 P{int(self.settle_ms)}")
+            lines += [f"M118 {SYNC_MARKER} {index}", "M114", f"G4 P{int(self.capture_dwell_ms)}"]
+        lines.append("M400")
+        return lines
+
+    def run_program(self, lines, on_stop, timeout=10):
+        """
+        Stream a compiled program with ok-based flow control: at most
+        `stream_window` lines are unacknowledged, so the planner buffer stays
+        full without a round trip per command.
+
+        Parameters:
+            lines: G-code lines from compile_program()
+            on_stop: called as on_stop(index, x, z) with the reported position
+                when the printer has reached a stop
+            timeout: seconds without any printer output before giving up
+        """
+        if not self.serial:
+            raise Exception("Serial connection not established")
+
+        # Acknowledgements left over from earlier commands would be counted
+        # against this program's window
+        self.serial.reset_input_buffer()
+
+        pending = deque(lines)
+        in_flight = 0
+        marker = None
+        last_response = time.time()
+
+        while pending or in_flight:
+            while pending and in_flight < self.stream_window:
+                self.serial.write((pending.popleft() + '\n').encode())
+                in_flight += 1
+
+            response = self.serial.readline().decode(errors='ignore').strip()
+            if not response:
+                if time.time() - last_response > timeout:
+                    raise Exception("Printer stopped responding while running a row program.")
+                continue
+            last_response = time.time()
+
+            if response.startswith("ok"):
+                in_flight = max(in_flight - 1, 0)
+            elif response.lower().startswith("error") or "crash detected" in response.lower():
+                raise Exception(f"Printer error during row program: {response}")
+            elif SYNC_PATTERN.search(response):
+                marker = int(SYNC_PATTERN.search(response).group(1))
+            elif marker is not None and POSITION_PATTERN.search(response):
+                x, _, z = (float(v) for v in POSITION_PATTERN.search(response).groups())
+                on_stop(marker, x, z)
+                marker = None
+
     def home(self):
         self.send_gcode("G1 Z15", wait=True)
         self.send_gcode("G28 Y0", wait=True)
@@ -0,0 +1,111 @@
+import os
+import json
+
+# ----------------------------------------------------------------
+#  Scan progress journal
+# ----------------------------------------------------------------
+# Append-only JSON lines file in the scan folder. The first line describes
+# the scan (grid, settings); every following line is one committed position.
+#
+# Frames are made durable in batches: commit() fsyncs the pending frame
+# files and the folder first, and only then appends their journal entries
+# and fsyncs the journal. A position listed in the journal therefore always
+# has its frame on disk; anything captured after the last commit is simply
+# captured again on resume.
+
+JOURNAL_NAME = "journal.jsonl"
+
+
+class ScanJournal:
+    def __init__(self, scan_folder, fsync_every=16):
+        self.scan_folder = scan_folder
+        self.path = os.path.join(scan_folder, JOURNAL_NAME)
+        self.fsync_every = fsync_every
+        self.header = None
+        self.completed = {}   # position index -> frame file name
+        self._pending = []
+        self._file = None
+
+    def open(self, header):
+        """
+        Start a new journal, or load an existing one for resuming.
+        Raises ValueError if an existing journal belongs to a different scan.
+        """
+        if os.path.exists(self.path):
+            self._load()
+            if self.header != header:
+                raise ValueError(f"Journal in {self.scan_folder} was written for different scan settings")
+            self._file = open(self.path, "a")
+            print(f"[INFO] Resuming scan: {len(self.completed)} position(s) already committed.")
+        else:
+            self.header = header
+            self._file = open(self.path, "w")
+            self._file.write(json.dumps({"header": header}) + "\n")
+            self._sync_journal()
+            _fsync_dir(self.scan_folder)
+        return self
+
+    def _load(self):
+        with open(self.path, "r") as f:
+            lines = f.read().splitlines()
+        self.header = json.loads(lines[0])["header"]
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break  # torn last line from a crash mid-append
+            if os.path.exists(os.path.join(self.scan_folder, entry["file"])):
+                self.completed[entry["i"]] = entry["file"]
+
+    @property
+    def frames_written(self):
+        """Committed plus pending positions."""
+        return len(self.completed) + len(self._pending)
+
+    def is_done(self, index):
+        return index in self.completed
+
+    def record(self, index, x, z, frame_path):
+        """Note a written frame; it becomes durable with the next commit()."""
+        self._pending.append({"i": index, "x": round(float(x), 3), "z": round(float(z), 3),
+                              "file": os.path.basename(frame_path)})
+        if len(self._pending) >= self.fsync_every:
+            self.commit()
+
+    def commit(self):
+        if not self._pending:
+            return
+        for entry in self._pending:
+            _fsync_file(os.path.join(self.scan_folder, entry["file"]))
+        _fsync_dir(self.scan_folder)
+
+        for entry in self._pending:
+            self._file.write(json.dumps(entry) + "\n")
+            self.completed[entry["i"]] = entry["file"]
+        self._sync_journal()
+        self._pending = []
+
+    def close(self):
+        if self._file:
+            self.commit()
+            self._file.close()
+            self._file = None
+
+    def _sync_journal(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+
+def _fsync_file(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_dir(path):
+    try:
+        _fsync_file(path)
+    except OSError:
+        pass  # directories cannot be fsynced on every platform
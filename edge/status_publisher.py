@@ -0,0 +1,130 @@
+import json
+import time
+import threading
+
+# ----------------------------------------------------------------
+#  Asynchronous MQTT status publisher
+# ----------------------------------------------------------------
+# Callers only merge fields into a pending update and return immediately.
+# A background thread publishes at most `rate_hz` times per second:
+#   - updates arriving in between are coalesced per topic,
+#   - only fields whose value changed are sent (non-retained),
+#   - a full retained snapshot is sent the first time a topic is published,
+#     when forced, and at most every `snapshot_interval` seconds while the
+#     state keeps changing, so subscribers that join late (e.g. Home
+#     Assistant after a restart) get the complete, current state.
+# Fields can also be dropped from a topic's state (e.g. the error of the
+# previous job); deltas cannot express a removal, so that forces a snapshot.
+
+_MISSING = object()
+
+
+class StatusPublisher:
+    def __init__(self, client, rate_hz=2.0, snapshot_interval=60.0):
+        self.client = client
+        self.min_interval = 1.0 / rate_hz if rate_hz > 0 else 0.0
+        self.snapshot_interval = snapshot_interval
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = {}          # topic -> merged fields not yet published
+        self._drops = {}            # topic -> fields to remove before merging pending ones
+        self._force_snapshot = set()
+        self._state = {}            # topic -> full published state
+        self._last_snapshot = {}    # topic -> time of last retained snapshot
+        self._stale = set()         # topics changed since their last snapshot
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="status-publisher", daemon=True)
+        self._thread.start()
+
+    def stop(self, flush=True):
+        self._running = False
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if flush:
+            self.flush()
+
+    def update(self, topic, fields, snapshot=False, drop=()):
+        """
+        Queue changed fields for `topic`. Never blocks on the network.
+        Fields named in `drop` are removed from the topic's state first.
+        """
+        with self._lock:
+            pending = self._pending.setdefault(topic, {})
+            for key in drop:
+                pending.pop(key, None)
+                self._drops.setdefault(topic, set()).add(key)
+            pending.update(fields)
+            if snapshot:
+                self._force_snapshot.add(topic)
+        self._wake.set()
+
+    def progress(self, topic, done, total, **extra):
+        """Per-frame scan progress; safe to call from the scan loop."""
+        fields = {
+            "frames_done": done,
+            "frames_total": total,
+            "progress": round(100.0 * done / total, 1) if total else 0.0,
+        }
+        fields.update(extra)
+        self.update(topic, fields)
+
+    def _run(self):
+        last_flush = 0.0
+        while self._running:
+            self._wake.wait(timeout=self.snapshot_interval or None)
+            self._wake.clear()
+
+            # Throttle: let further updates coalesce until the interval has passed
+            wait = self.min_interval - (time.time() - last_flush)
+            if wait > 0:
+                time.sleep(wait)
+            self.flush()
+            last_flush = time.time()
+
+    def flush(self):
+        """Publish everything pending now (also sends snapshots that are due)."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            forced, self._force_snapshot = self._force_snapshot, set()
+            drops, self._drops = self._drops, {}
+
+        now = time.time()
+        for topic in set(pending) | set(self._state):
+            fields = pending.get(topic, {})
+            state = self._state.setdefault(topic, {})
+            dropped = [k for k in drops.get(topic, ()) if k in state and k not in fields]
+            for key in drops.get(topic, ()):
+                state.pop(key, None)
+            changed = {k: v for k, v in fields.items() if state.get(k, _MISSING) != v}
+            state.update(fields)
+
+            if changed:
+                self._stale.add(topic)
+
+            last = self._last_snapshot.get(topic)
+            due = (topic in forced or dropped or last is None
+                   or (topic in self._stale and self.snapshot_interval
+                       and now - last >= self.snapshot_interval))
+
+            if due:
+                self._publish(topic, state, retain=True)
+                self._last_snapshot[topic] = now
+                self._stale.discard(topic)
+            elif changed:
+                self._publish(topic, changed, retain=False)
+
+    def _publish(self, topic, data, retain):
+        try:
+            self.client.publish(topic, json.dumps(data), retain=retain)
+            print(f"Published {'snapshot' if retain else 'update'} on {topic}: {data}\n")
+        except Exception as e:
+            print(f"[WARNING] Status publish on {topic} failed: {e}\n")
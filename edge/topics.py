@@ -0,0 +1,30 @@
+# ----------------------------------------------------------------
+#  Per-rig MQTT topics and upload names
+# ----------------------------------------------------------------
+# Every topic of a rig is namespaced by its rig_id, so rigs set up from the
+# same config.yaml (with only rig_id changed) never share a command topic.
+# The orchestrator learns the map from the rig's retained announcement.
+# Scan tarballs carry the rig_id too: all rigs upload into one folder and
+# two rigs can finish a scan within the same second.
+
+
+def rig_topics(rig_id):
+    """Topic map of the rig `rig_id`."""
+    return {
+        "announce": f"status/gf/{rig_id}/announce",
+        "status": f"status/gf/{rig_id}/state",
+        "scan_progress": f"status/gf/{rig_id}/progress",
+        "camera_status": f"status/gf/{rig_id}/camera_state",
+        "printer_status": f"status/gf/{rig_id}/printer_state",
+        "scan_command": f"cmd/gf/{rig_id}/scan/req",
+        "camera_picture": f"cmd/gf/{rig_id}/picture/req",
+        "printer_gcode": f"cmd/gf/{rig_id}/printer_gcode/req",
+        "config_request": f"cmd/gf/{rig_id}/config/req",
+        "config_response": f"dt/gf/{rig_id}/config/res",
+        "scan_result": f"dt/gf/{rig_id}/scan/res",
+    }
+
+
+def tarball_name(rig_id, scan_name):
+    """Upload name of the tarball of scan folder `scan_name`."""
+    return f"{rig_id}_{scan_name}.tar.gz"
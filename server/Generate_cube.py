@@ -1,42 +1,127 @@
+import io
 import os
+import sys
+from collections import Counter
 import numpy as np
-import cv2
 
-# Paths
-DATA_DIR = "/home/kybfarm/kybfarm/server/homeassistant/config/HSI/scanner_data"
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
 
-print(f"Looking for scans in: {DATA_DIR}")
+from utils.frame_codec import read_frame
+from scan_catalog import DATA_DIR, ScanCatalog, parse_frame_name
 
-# Find latest scan folder
-scan_folders = [f for f in os.listdir(DATA_DIR)
-                if f.startswith("scan_") and os.path.isdir(os.path.join(DATA_DIR, f))]
-if not scan_folders:
-    raise FileNotFoundError(f"No scan folders found in: {DATA_DIR}")
+CUBE_NAME = "hyperspectral_cube.npy"
 
-scan_folders.sort(reverse=True)
-latest_scan = scan_folders[0]
-scan_folder = os.path.join(DATA_DIR, latest_scan)
 
-print(f"Using latest scan: {scan_folder}")
+def list_frames(scan_folder):
+    """Frame files of a scan in scan order (Z, then X), sorted numerically."""
+    frames = []
+    for fname in os.listdir(scan_folder):
+        pos = parse_frame_name(fname)
+        if pos:
+            frames.append((pos[1], pos[0], fname))
+    frames.sort()
+    return [fname for _, _, fname in frames]
 
-# Find images
-image_files = [f for f in os.listdir(scan_folder) if f.endswith(".png") and f.startswith("X")]
-image_files.sort()  # or sort by X number
 
-images = []
-for fname in image_files:
-    img_path = os.path.join(scan_folder, fname)
-    img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
-    if img is None:
-        print(f"Warning: could not read {fname}")
-        continue
-    images.append(img)
+def frame_cache_size(frames):
+    """
+    read_frame() cache size for reading `frames` in list_frames() order.
 
-if not images:
-    raise RuntimeError("No valid images loaded.")
+    Delta frames refer to the previously captured frame, but serpentine
+    scans capture every other row backwards; caching a full row keeps those
+    rows from decoding back to their keyframe for every frame.
+    """
+    rows = Counter(parse_frame_name(fname)[1] for fname in frames)
+    return max(rows.values(), default=0) + 2
 
-cube = np.stack(images, axis=2)  # (H, W, Bands)
 
-npz_path = os.path.join(scan_folder, "hyperspectral_cube.npz")
-np.savez_compressed(npz_path, cube=cube)
-print(f"Saved cube to: {npz_path}")
+def build_cube(scan_folder, cube_path=None):
+    """
+    Stack the line frames of a scan into a cube.
+
+    Each frame is one scan line (spatial, spectral), so frames are stacked
+    along the first axis. With `cube_path`, frames are streamed straight into
+    a memory-mapped .npy there, so only one frame is held in memory.
+
+    Returns:
+        np.ndarray (or memmap) of shape (H, W, B) = (scan positions, spatial, bands)
+    """
+    frames = list_frames(scan_folder)
+    cache_size = frame_cache_size(frames)
+    cube = None
+    rows = 0
+    cache = {}
+    for fname in frames:
+        img_path = os.path.join(scan_folder, fname)
+        img = read_frame(img_path, cache, cache_size)
+        if img is None:
+            print(f"Warning: could not read {fname}")
+            continue
+        if cube is None:
+            shape = (len(frames),) + img.shape
+            if cube_path:
+                cube = np.lib.format.open_memmap(cube_path, mode="w+", dtype=img.dtype, shape=shape)
+            else:
+                cube = np.empty(shape, dtype=img.dtype)
+        cube[rows] = img
+        rows += 1
+
+    if cube is None:
+        raise RuntimeError("No valid images loaded.")
+
+    if rows < cube.shape[0]:
+        if not cube_path:
+            return cube[:rows]
+        cube.flush()
+        del cube
+        _truncate_npy(cube_path, rows)
+        return np.load(cube_path, mmap_mode="r+")
+    if cube_path:
+        cube.flush()
+    return cube
+
+
+def _truncate_npy(path, rows):
+    """Shrink the first axis of a C-ordered .npy in place (header rewrite plus truncate)."""
+    with open(path, "r+b") as f:
+        version = np.lib.format.read_magic(f)
+        read_header = (np.lib.format.read_array_header_1_0 if version == (1, 0)
+                       else np.lib.format.read_array_header_2_0)
+        shape, fortran, dtype = read_header(f)
+        offset = f.tell()
+        new_shape = (rows,) + tuple(shape[1:])
+
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, {"descr": np.lib.format.dtype_to_descr(dtype),
+                                                      "fortran_order": fortran, "shape": new_shape})
+        if version != (1, 0) or header.tell() != offset:
+            raise RuntimeError(f"Cannot rewrite header of {path} in place")
+        f.seek(0)
+        f.write(header.getvalue())
+        f.truncate(offset + int(np.prod(new_shape)) * dtype.itemsize)
+
+
+def main():
+    print(f"Looking for scans in: {DATA_DIR}")
+
+    catalog = ScanCatalog(DATA_DIR)
+    catalog.refresh()
+    latest = catalog.latest()
+    if latest is None:
+        raise FileNotFoundError(f"No scan folders found in: {DATA_DIR}")
+
+    scan_folder = latest["path"]
+    print(f"Using latest scan: {scan_folder}")
+
+    cube_path = os.path.join(scan_folder, CUBE_NAME)
+    cube = build_cube(scan_folder, cube_path)
+    print(f"Cube shape: {cube.shape}")
+    del cube
+    catalog.register(scan_folder)
+    print(f"Saved cube to: {cube_path}")
+
+
+if __name__ == "__main__":
+    main()
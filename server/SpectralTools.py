@@ -1,5 +1,8 @@
+import os
+import json
+import hashlib
 import numpy as np
-import matplotlib.pyplot as plt
+import cv2
 
 # ----------------------------------------------------------------
 #  NDVI Calculation
@@ -9,20 +12,349 @@ def calculate_ndvi(cube: np.ndarray, red_band_idx: int, nir_band_idx: int) -> np
     Calculate NDVI from a hyperspectral cube.
 
     Parameters:
-        cube: np.ndarray of shape (H, W, B)
+        cube: np.ndarray of shape (H, W, B), or compressed pixels (N, B)
         red_band_idx: index of the red band
         nir_band_idx: index of the NIR band
 
     Returns:
-        NDVI image (H, W) as float32
+        NDVI image (H, W), or (N,) for compressed pixels, as float32
     """
-    red = cube[:, :, red_band_idx].astype(np.float32)
-    nir = cube[:, :, nir_band_idx].astype(np.float32)
+    red = cube[..., red_band_idx].astype(np.float32)
+    nir = cube[..., nir_band_idx].astype(np.float32)
     bottom = nir + red
     bottom[bottom == 0] = 1e-5  # avoid division by zero
     ndvi = (nir - red) / bottom
     return ndvi
 
+# ----------------------------------------------------------------
+#  Plant / background segmentation
+# ----------------------------------------------------------------
+PLANT_MASK_NAME = "plant_mask.png"
+PLANT_MASK_PARAMS = "plant_mask.json"
+
+def segment_plants(cube: np.ndarray, red_band_idx: int, nir_band_idx: int,
+                   threshold: float = 0.3, kernel_size: int = 5, min_area: int = 50) -> np.ndarray:
+    """
+    Plant mask from NDVI thresholding plus morphological cleanup.
+
+    Parameters:
+        cube: np.ndarray of shape (H, W, B)
+        red_band_idx, nir_band_idx: band indices for NDVI
+        threshold: NDVI above which a pixel counts as plant
+        kernel_size: size of the elliptical opening/closing kernel
+        min_area: connected components smaller than this (pixels) are dropped
+
+    Returns:
+        Boolean mask (H, W)
+    """
+    return segment_ndvi(calculate_ndvi(cube, red_band_idx, nir_band_idx), threshold, kernel_size, min_area)
+
+def segment_ndvi(ndvi: np.ndarray, threshold: float = 0.3, kernel_size: int = 5,
+                 min_area: int = 50) -> np.ndarray:
+    """
+    Plant mask from an already computed NDVI image (H, W), e.g. the output of
+    a tiled pass; see segment_plants() for the parameters.
+    """
+    mask = (ndvi > threshold).astype(np.uint8)
+
+    if kernel_size > 1:
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+
+    if min_area > 0:
+        _, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        keep = stats[:, cv2.CC_STAT_AREA] >= min_area
+        keep[0] = False  # background component
+        return keep[labels]
+
+    return mask.astype(bool)
+
+def cube_digest(cube: np.ndarray) -> str:
+    """
+    Identity of a cube's contents: size and mtime of the backing file for a
+    memmap, otherwise a hash of the data.
+    """
+    filename = getattr(cube, "filename", None)
+    if filename:
+        st = os.stat(filename)
+        return f"file:{st.st_size}:{st.st_mtime_ns}"
+    return "sha256:" + hashlib.sha256(np.ascontiguousarray(cube).data).hexdigest()
+
+def load_plant_mask(scan_folder: str, cube: np.ndarray, red_band_idx: int, nir_band_idx: int,
+                    input_digest: str = None, ndvi: np.ndarray = None, **params) -> np.ndarray:
+    """
+    Plant mask of a scan, computed once and cached in the scan folder.
+    The cache is reused only if it was made from the same cube, with the same
+    bands and parameters.
+
+    Parameters:
+        input_digest: identity of the cube (e.g. the batch manifest hash);
+            derived with cube_digest() if omitted
+        ndvi: NDVI of the cube for these bands, if already computed; the
+            cube is then not read
+    """
+    params = dict(red_band_idx=red_band_idx, nir_band_idx=nir_band_idx, **params)
+    cache_key = dict(params, input_digest=input_digest or cube_digest(cube))
+    mask_path = os.path.join(scan_folder, PLANT_MASK_NAME)
+    params_path = os.path.join(scan_folder, PLANT_MASK_PARAMS)
+
+    if os.path.exists(mask_path) and os.path.exists(params_path):
+        with open(params_path, "r") as f:
+            cached = json.load(f)
+        if cached == cache_key:
+            mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+            if mask is not None and mask.shape == cube.shape[:2]:
+                return mask > 0
+
+    if ndvi is not None:
+        mask = segment_ndvi(ndvi, **{k: v for k, v in params.items() if not k.endswith("_band_idx")})
+    else:
+        mask = segment_plants(cube, **params)
+    cv2.imwrite(mask_path, mask.astype(np.uint8) * 255)
+    with open(params_path, "w") as f:
+        json.dump(cache_key, f)
+    return mask
+
+def compress_pixels(cube: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """
+    Spectra of the masked pixels only.
+
+    Returns:
+        np.ndarray (N, B), in row-major pixel order
+    """
+    return cube[mask]
+
+def expand_pixels(values: np.ndarray, mask: np.ndarray, fill=np.nan) -> np.ndarray:
+    """
+    Scatter per-pixel values (N,) or (N, B) back to image layout (H, W[, B]).
+    Pixels outside the mask are set to `fill`.
+    """
+    out = np.full(mask.shape + values.shape[1:], fill, dtype=np.result_type(values, fill))
+    out[mask] = values
+    return out
+
+def mean_spectrum(cube: np.ndarray, mask: np.ndarray = None) -> np.ndarray:
+    """
+    Mean spectrum over all pixels, or only the masked ones.
+
+    Parameters:
+        cube: np.ndarray of shape (H, W, B), or compressed pixels (N, B)
+        mask: optional boolean mask (H, W)
+
+    Returns:
+        np.ndarray (B,) as float32
+    """
+    pixels = compress_pixels(cube, mask) if mask is not None else cube.reshape(-1, cube.shape[-1])
+    return pixels.mean(axis=0, dtype=np.float64).astype(np.float32)
+
+# ----------------------------------------------------------------
+#  Region-of-interest statistics
+# ----------------------------------------------------------------
+def rasterize_rois(rois, shape) -> np.ndarray:
+    """
+    Burn a list of ROIs into a label image.
+
+    Parameters:
+        rois: list of ROIs, each one of
+              - rectangle (x0, y0, x1, y1), end-exclusive
+              - polygon, array-like of (x, y) vertices with 3+ points
+              - boolean mask of shape (H, W)
+        shape: (H, W) of the cube
+
+    Returns:
+        int32 label image (H, W); ROI i has label i + 1, 0 is unassigned.
+        Where ROIs overlap, the later one wins.
+    """
+    labels = np.zeros(shape, dtype=np.int32)
+    for i, roi in enumerate(rois, start=1):
+        roi = np.asarray(roi)
+        if roi.shape == shape and roi.dtype == bool:
+            labels[roi] = i
+        elif roi.ndim == 1 and roi.shape[0] == 4:
+            x0, y0, x1, y1 = roi.astype(int)
+            labels[y0:y1, x0:x1] = i
+        elif roi.ndim == 2 and roi.shape[1] == 2 and roi.shape[0] >= 3:
+            cv2.fillPoly(labels, [np.round(roi).astype(np.int32)], int(i))
+        else:
+            raise ValueError(f"Unsupported ROI #{i - 1} with shape {roi.shape}")
+    return labels
+
+def roi_statistics(cube: np.ndarray, rois, percentiles=(10, 50, 90), mask: np.ndarray = None) -> dict:
+    """
+    Mean/std/percentile spectra for many ROIs in one pass over the cube.
+
+    Pixels are grouped by label once and every statistic is a segmented
+    reduction over the grouped pixels, so the cost does not grow with the
+    number of ROIs.
+
+    Parameters:
+        cube: np.ndarray of shape (H, W, B)
+        rois: list of ROIs (see rasterize_rois) or an integer label image (H, W),
+              where each non-zero label is one ROI
+        percentiles: percentiles (0-100) to compute per band
+        mask: optional boolean mask (H, W); pixels outside it are ignored
+
+    Returns:
+        dict with
+            labels: (K,) ROI labels
+            count: (K,) pixels per ROI
+            mean, std: (K, B) float32
+            percentiles: (P, K, B) float32
+        ROIs without pixels get NaN statistics.
+    """
+    h, w, bands = cube.shape
+    if isinstance(rois, np.ndarray) and rois.shape == (h, w) and np.issubdtype(rois.dtype, np.integer):
+        labels = rois
+        roi_labels = np.unique(labels[labels != 0])
+    else:
+        labels = rasterize_rois(rois, (h, w))
+        roi_labels = np.arange(1, len(rois) + 1)
+
+    flat = labels.ravel()
+    selected = flat != 0
+    if mask is not None:
+        selected &= mask.ravel()
+
+    # Group pixels by label (stable, so each group stays in pixel order)
+    idx = np.flatnonzero(selected)
+    order = np.argsort(flat[idx], kind="stable")
+    idx = idx[order]
+    grouped_labels = flat[idx]
+    pixels = cube.reshape(-1, bands)[idx].astype(np.float64)
+
+    present, starts, counts = np.unique(grouped_labels, return_index=True, return_counts=True)
+    k = len(roi_labels)
+    out = {
+        "labels": roi_labels,
+        "count": np.zeros(k, dtype=np.int64),
+        "mean": np.full((k, bands), np.nan, dtype=np.float32),
+        "std": np.full((k, bands), np.nan, dtype=np.float32),
+        "percentiles": np.full((len(percentiles), k, bands), np.nan, dtype=np.float32),
+    }
+    if len(present) == 0:
+        return out
+    slot = np.searchsorted(roi_labels, present)
+
+    sums = np.add.reduceat(pixels, starts, axis=0)
+    sq_sums = np.add.reduceat(pixels * pixels, starts, axis=0)
+    mean = sums / counts[:, None]
+    var = np.maximum(sq_sums / counts[:, None] - mean * mean, 0.0)
+
+    out["count"][slot] = counts
+    out["mean"][slot] = mean
+    out["std"][slot] = np.sqrt(var)
+
+    if len(percentiles):
+        # Sort within groups in one call by offsetting each group into its own value range
+        group = np.repeat(np.arange(len(present)), counts)[:, None]
+        lo, hi = pixels.min(), pixels.max()
+        span = hi - lo + 1.0
+        ranked = np.sort(pixels - lo + group * span, axis=0) - group * span + lo
+
+        for p, q in enumerate(percentiles):
+            pos = starts + (q / 100.0) * (counts - 1)
+            below = np.floor(pos).astype(np.int64)
+            above = np.minimum(below + 1, starts + counts - 1)
+            frac = (pos - below)[:, None]
+            out["percentiles"][p, slot] = ranked[below] * (1.0 - frac) + ranked[above] * frac
+
+    return out
+
+# ----------------------------------------------------------------
+#  Spectral library matching (SAM / Euclidean)
+# ----------------------------------------------------------------
+def load_spectral_library(path: str):
+    """
+    Load reference spectra from a JSON file {"class name": [b0, b1, ...], ...}.
+
+    Returns:
+        (names, spectra) with spectra as float32 array (K, B)
+    """
+    with open(path, "r") as f:
+        library = json.load(f)
+    names = list(library)
+    return names, np.array([library[n] for n in names], dtype=np.float32)
+
+def classify_spectra(cube: np.ndarray, library: np.ndarray, method: str = "sam",
+                     max_score: float = None, mask: np.ndarray = None, tile_pixels: int = 65536):
+    """
+    Match every pixel against a library of reference spectra.
+
+    Scores are computed as one (tile, B) x (B, K) matrix product per tile of
+    pixels, so memory stays bounded by `tile_pixels` regardless of cube size.
+
+    Parameters:
+        cube: np.ndarray of shape (H, W, B), or compressed pixels (N, B)
+        library: np.ndarray (K, B) of reference spectra
+        method: "sam" (spectral angle, radians) or "euclidean"
+        max_score: pixels whose best angle/distance exceeds this are unclassified (-1)
+        mask: optional boolean mask (H, W); pixels outside it are unclassified
+        tile_pixels: pixels processed per matrix product
+
+    Returns:
+        class_map: int16 (H, W) or (N,), index into the library, -1 if unclassified
+        score: float32, angle or distance to the best match
+        confidence: float32 in [0, 1], 1 - best / second-best score
+    """
+    if method not in ("sam", "euclidean"):
+        raise ValueError(f"Unknown method: {method}")
+    if mask is not None:
+        class_map, score, confidence = classify_spectra(
+            compress_pixels(cube, mask), library, method, max_score, tile_pixels=tile_pixels)
+        return (expand_pixels(class_map, mask, fill=-1), expand_pixels(score, mask),
+                expand_pixels(confidence, mask, fill=0.0))
+
+    library = np.asarray(library, dtype=np.float32)
+    if method == "sam":
+        lib_t = library.T
+        lib_norm = np.sqrt((library * library).sum(axis=1))
+        lib_norm[lib_norm == 0] = 1e-12
+    else:
+        # The expanded |a|^2 - 2ab + |b|^2 cancels badly for close spectra of
+        # 12-bit data, so it is evaluated in float64 around the library mean
+        center = library.mean(axis=0, dtype=np.float64)
+        lib_c = library.astype(np.float64) - center
+        lib_t = lib_c.T
+        lib_sq = (lib_c * lib_c).sum(axis=1)
+
+    pixels = cube.reshape(-1, cube.shape[-1])
+    n = pixels.shape[0]
+    class_map = np.empty(n, dtype=np.int16)
+    score = np.empty(n, dtype=np.float32)
+    confidence = np.empty(n, dtype=np.float32)
+
+    for start in range(0, n, tile_pixels):
+        if method == "sam":
+            tile = np.asarray(pixels[start:start + tile_pixels], dtype=np.float32)
+            dot = tile @ lib_t                                  # (t, K)
+            tile_norm = np.sqrt((tile * tile).sum(axis=1, keepdims=True))
+            tile_norm[tile_norm == 0] = 1e-12
+            scores = np.arccos(np.clip(dot / (tile_norm * lib_norm), -1.0, 1.0))
+        else:
+            tile = np.asarray(pixels[start:start + tile_pixels], dtype=np.float64) - center
+            tile_sq = (tile * tile).sum(axis=1, keepdims=True)
+            scores = np.sqrt(np.maximum(tile_sq - 2.0 * (tile @ lib_t) + lib_sq, 0.0)).astype(np.float32)
+
+        if scores.shape[1] > 1:
+            two_best = np.partition(scores, 1, axis=1)[:, :2]
+            best, second = two_best[:, 0], two_best[:, 1]
+        else:
+            best = scores[:, 0]
+            second = np.full_like(best, np.pi / 2 if method == "sam" else np.inf)
+
+        end = start + tile.shape[0]
+        class_map[start:end] = np.argmin(scores, axis=1)
+        score[start:end] = best
+        with np.errstate(divide="ignore", invalid="ignore"):
+            confidence[start:end] = np.nan_to_num(1.0 - best / second, nan=0.0)
+
+    if max_score is not None:
+        class_map[score > max_score] = -1
+
+    shape = cube.shape[:-1]
+    return class_map.reshape(shape), score.reshape(shape), confidence.reshape(shape)
+
 # ----------------------------------------------------------------
 #  Plot spectrum of a single pixel
 # ----------------------------------------------------------------
@@ -35,6 +367,8 @@ def plot_pixel_spectrum(cube: np.ndarray, x: int, y: int, wavelengths=None):
         x, y: coordinates of the pixel
         wavelengths: list or array of wavelengths (optional)
     """
+    import matplotlib.pyplot as plt
+
     spectrum = cube[y, x, :]
     bands = np.arange(spectrum.shape[0]) if wavelengths is None else wavelengths
 
@@ -60,6 +394,8 @@ def show_band(cube: np.ndarray, band_idx: int, wavelength=None):
         band_idx: index of the band to show
         wavelength: optional label for the band
     """
+    import matplotlib.pyplot as plt
+
     img = cube[:, :, band_idx]
     title = f"Band {band_idx}" + (f" ({wavelength} nm)" if wavelength else "")
 
@@ -0,0 +1,262 @@
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import argparse
+import numpy as np
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from utils import config
+from scan_catalog import DATA_DIR, META_FILE, ScanCatalog
+
+# ----------------------------------------------------------------
+#  Resampling to standard band sets
+# ----------------------------------------------------------------
+# Native band indices depend on the binning and the smile calibration, so
+# cubes are resampled to fixed band sets through spectral response function
+# (SRF) matrices: every output band is a Gaussian-weighted average of the
+# native bands within 3 sigma of its centre. The matrix only depends on the
+# native wavelengths and the band set, so it is built once, cached on disk
+# per calibration, and applied as a single matrix multiply per tile.
+
+SRF_VERSION = 1
+SRF_CUTOFF_SIGMA = 3.0
+FWHM_TO_SIGMA = 1.0 / (2.0 * np.sqrt(2.0 * np.log(2.0)))
+
+# (name, centre nm, FWHM nm); Sentinel-2 MSI bands inside the sensor range
+SENTINEL2_BANDS = [
+    ("B1", 442.7, 21.0),
+    ("B2", 492.4, 66.0),
+    ("B3", 559.8, 36.0),
+    ("B4", 664.6, 31.0),
+    ("B5", 704.1, 15.0),
+    ("B6", 740.5, 15.0),
+    ("B7", 782.8, 20.0),
+]
+
+BAND_SETS = {
+    "grid5": [(f"{c:g}nm", float(c), 5.0) for c in np.arange(400, 801, 5)],
+    "sentinel2": SENTINEL2_BANDS,
+}
+
+
+def scan_wavelengths(scan_folder, n_bands):
+    """
+    Native band centres (nm) of a scan.
+
+    Taken from scan_meta.json when the edge recorded them (smile-corrected
+    scans), otherwise assumed linear between START_ and END_WAVELENGTH.
+    """
+    meta_path = os.path.join(scan_folder, META_FILE)
+    if os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            wavelengths = json.load(f).get("wavelengths")
+        if wavelengths and len(wavelengths) == n_bands:
+            return np.asarray(wavelengths, dtype=np.float64)
+    return np.linspace(config.START_WAVELENGTH, config.END_WAVELENGTH, n_bands)
+
+
+def nearest_band(wavelengths, nm):
+    """Index of the band closest to `nm`, for picking bands by wavelength instead of index."""
+    return int(np.argmin(np.abs(np.asarray(wavelengths) - nm)))
+
+
+def srf_matrix(native_wavelengths, centers, fwhm):
+    """
+    Gaussian SRF matrix.
+
+    Parameters:
+        native_wavelengths: (B,) native band centres
+        centers, fwhm: (K,) output band centres and widths
+
+    Returns:
+        (matrix, lo, hi): matrix of shape (hi - lo, K) acting on native bands lo:hi;
+        native bands outside every response are dropped
+    """
+    native = np.asarray(native_wavelengths, dtype=np.float64)
+    centers = np.asarray(centers, dtype=np.float64)
+    sigma = np.asarray(fwhm, dtype=np.float64) * FWHM_TO_SIGMA
+
+    # Native band widths, so uneven sampling is integrated correctly
+    widths = np.abs(np.gradient(native)) if native.size > 1 else np.ones(1)
+    d = (native[:, None] - centers[None, :]) / sigma[None, :]
+    weights = np.where(np.abs(d) <= SRF_CUTOFF_SIGMA, np.exp(-0.5 * d ** 2), 0.0) * widths[:, None]
+
+    # Bands narrower than the native sampling: linear interpolation instead
+    order = np.argsort(native)
+    for k in np.flatnonzero(weights.sum(axis=0) == 0):
+        j = np.clip(np.searchsorted(native[order], centers[k]), 1, native.size - 1)
+        a, b = order[j - 1], order[j]
+        t = np.clip((centers[k] - native[a]) / (native[b] - native[a]), 0.0, 1.0)
+        weights[a, k], weights[b, k] = 1.0 - t, t
+
+    weights /= weights.sum(axis=0, keepdims=True)
+    used = np.flatnonzero(weights.any(axis=1))
+    lo, hi = int(used[0]), int(used[-1]) + 1
+    return weights[lo:hi].astype(np.float32), lo, hi
+
+
+class BandResampler:
+    def __init__(self, native_wavelengths, band_set="sentinel2"):
+        """
+        Parameters:
+            native_wavelengths: (B,) native band centres in nm
+            band_set: key of BAND_SETS
+        """
+        self.native_wavelengths = np.asarray(native_wavelengths, dtype=np.float64)
+        self.band_set = band_set
+        self._select_bands()
+        self.matrix, self.lo, self.hi = srf_matrix(self.native_wavelengths, self.centers, self.fwhm)
+
+    def _select_bands(self):
+        """Keep the bands of the set whose centre lies inside the native range."""
+        lo_nm, hi_nm = self.native_wavelengths.min(), self.native_wavelengths.max()
+        bands = [b for b in BAND_SETS[self.band_set] if lo_nm <= b[1] <= hi_nm]
+        if not bands:
+            raise ValueError(f"No '{self.band_set}' band lies within {lo_nm:.0f}-{hi_nm:.0f} nm")
+        self.names = [b[0] for b in bands]
+        self.centers = np.array([b[1] for b in bands])
+        self.fwhm = np.array([b[2] for b in bands])
+
+    @staticmethod
+    def cache_key(native_wavelengths, band_set):
+        h = hashlib.sha256()
+        h.update(f"srf:{SRF_VERSION}:{SRF_CUTOFF_SIGMA}:{band_set}".encode())
+        h.update(json.dumps(BAND_SETS[band_set]).encode())
+        h.update(np.round(np.asarray(native_wavelengths, dtype=np.float64), 3).tobytes())
+        return h.hexdigest()[:16]
+
+    def apply(self, pixels):
+        """
+        Resample spectra.
+
+        Parameters:
+            pixels: (..., B) cube, tile or compressed pixels
+
+        Returns:
+            (..., K) float32
+        """
+        return pixels[..., self.lo:self.hi].astype(np.float32) @ self.matrix
+
+    def resample_cube(self, cube, out=None, tile_rows=64):
+        """
+        Resample an (H, W, B) cube tile by tile, so a memmapped cube is never
+        fully loaded. `out` may be a preallocated (H, W, K) array or memmap.
+        """
+        if out is None:
+            out = np.empty(cube.shape[:2] + (len(self.names),), dtype=np.float32)
+        for r0 in range(0, cube.shape[0], tile_rows):
+            out[r0:r0 + tile_rows] = self.apply(cube[r0:r0 + tile_rows])
+        return out
+
+    def save(self, path):
+        np.savez(path, native_wavelengths=self.native_wavelengths, band_set=self.band_set,
+                 matrix=self.matrix, lo=self.lo, hi=self.hi)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            resampler = cls.__new__(cls)
+            resampler.native_wavelengths = data["native_wavelengths"]
+            resampler.band_set = str(data["band_set"])
+            resampler.matrix = data["matrix"]
+            resampler.lo, resampler.hi = int(data["lo"]), int(data["hi"])
+        resampler._select_bands()
+        return resampler
+
+
+_resamplers = {}
+
+def _save_cached(resampler, path):
+    """
+    Write a cache entry through a per-process temp file. Batch workers may
+    build the same matrix concurrently; the entries are identical, so losing
+    the race to another writer is fine.
+    """
+    cache_dir = os.path.dirname(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=".srf_", suffix=".npz")
+    os.close(fd)
+    try:
+        resampler.save(tmp_path)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        if not os.path.exists(path):
+            print(f"[WARNING] Could not cache SRF matrix at {path}: {e}")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def get_resampler(native_wavelengths, band_set="sentinel2", cache_dir=config.SRF_CACHE_DIR):
+    """BandResampler for these native wavelengths, from memory, the disk cache, or built and cached."""
+    key = BandResampler.cache_key(native_wavelengths, band_set)
+    if key in _resamplers:
+        return _resamplers[key]
+
+    path = os.path.join(cache_dir, f"srf_{band_set}_{key}.npz")
+    if os.path.exists(path):
+        resampler = BandResampler.load(path)
+    else:
+        resampler = BandResampler(native_wavelengths, band_set)
+        _save_cached(resampler, path)
+    _resamplers[key] = resampler
+    return resampler
+
+
+def resampled_name(band_set):
+    return f"resampled_{band_set}.npy"
+
+
+def resample_scan(scan_folder, cube, band_set="sentinel2"):
+    """
+    Write the resampled cube of a scan plus a JSON sidecar with the band names
+    and centres.
+
+    Returns:
+        path of the resampled cube
+    """
+    resampler = get_resampler(scan_wavelengths(scan_folder, cube.shape[-1]), band_set)
+    out_path = os.path.join(scan_folder, resampled_name(band_set))
+    out = np.lib.format.open_memmap(out_path, mode="w+", dtype=np.float32,
+                                    shape=cube.shape[:2] + (len(resampler.names),))
+    resampler.resample_cube(cube, out)
+    out.flush()
+    del out
+
+    with open(out_path[:-len(".npy")] + ".json", "w") as f:
+        json.dump({"band_set": band_set, "names": resampler.names,
+                   "centers": resampler.centers.tolist(), "fwhm": resampler.fwhm.tolist()}, f, indent=2)
+    return out_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resample scan cubes to a standard band set.")
+    parser.add_argument("scans", nargs="*", help="Scan folders (default: latest catalogued scan with a cube)")
+    parser.add_argument("--band-set", default="sentinel2", choices=sorted(BAND_SETS))
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    args = parser.parse_args(argv)
+
+    catalog = ScanCatalog(args.data_dir)
+    catalog.refresh()
+    if args.scans:
+        scans = [catalog.get(catalog.scan_name(os.path.abspath(s))) for s in args.scans]
+    else:
+        scans = [catalog.latest(with_cube=True)]
+
+    for scan in scans:
+        if scan is None or scan["cube_path"] is None:
+            print("[WARNING] Scan not found or has no cube; run Generate_cube.py first.")
+            continue
+        cube = catalog.open_cube(scan)
+        out_path = resample_scan(scan["path"], cube, args.band_set)
+        print(f"Saved {args.band_set} cube to: {out_path}")
+    catalog.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
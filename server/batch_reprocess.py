@@ -0,0 +1,251 @@
+import os
+import sys
+import glob
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+import cv2
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+from Generate_cube import CUBE_NAME, build_cube, list_frames
+from cube_tiles import CubeHandle, TiledPipeline
+from utils.frame_codec import read_frame
+from SpectralTools import PLANT_MASK_NAME, calculate_ndvi, load_plant_mask
+from scan_catalog import DATA_DIR, ScanCatalog
+from band_resampling import get_resampler, nearest_band, resample_scan, resampled_name, scan_wavelengths
+from utils import config
+
+# ----------------------------------------------------------------
+#  Batch reprocessing of historical scans
+# ----------------------------------------------------------------
+# Bump when the outputs change for the same inputs, to force a rebuild.
+PIPELINE_VERSION = 3
+MANIFEST_NAME = "outputs.json"
+NDVI_NAME = "ndvi.npy"
+RGB_NAME = "rgb_preview.png"
+
+# The cube is streamed to disk and processed in tiles, so a job needs one
+# tile budget plus its per-pixel outputs (float32 RGB and NDVI, stretch copies)
+OUTPUT_BYTES_PER_PIXEL = 48
+
+# Band centres (nm) for RGB and NDVI on a resampled cube; "red_nm", "green_nm",
+# "blue_nm" and "nir_nm" in calibration.json override them
+BAND_NM = {"red": 664.6, "green": 559.8, "blue": 492.4, "nir": 782.8}
+
+
+def load_calibration(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def inputs_hash(scan_folder, calibration):
+    """Content hash of everything a scan's outputs depend on."""
+    h = hashlib.sha256()
+    h.update(f"pipeline:{PIPELINE_VERSION}".encode())
+    h.update(json.dumps(calibration, sort_keys=True).encode())
+    for fname in list_frames(scan_folder):
+        h.update(fname.encode())
+        with open(os.path.join(scan_folder, fname), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def select_bands(calibration, centers=None):
+    """
+    Band indices for RGB and NDVI.
+
+    Parameters:
+        calibration: dict from calibration.json
+        centers: band centres (nm) of a resampled cube, or None for the native cube
+
+    Returns:
+        (red, green, blue, nir); on the native cube these are the calibrated
+        indices and nir is None unless "nir_band" is set
+    """
+    if centers is None:
+        return (calibration["red_band"], calibration["green_band"], calibration["blue_band"],
+                calibration.get("nir_band"))
+    return tuple(nearest_band(centers, calibration.get(f"{name}_nm", BAND_NM[name]))
+                 for name in ("red", "green", "blue", "nir"))
+
+
+def estimate_memory(scan_folder):
+    """Rough peak memory (bytes) needed to process a scan."""
+    frames = list_frames(scan_folder)
+    if not frames:
+        return 0
+    # Frames are compressed, so decode one for the spatial width
+    first = read_frame(os.path.join(scan_folder, frames[0]))
+    width = first.shape[0] if first is not None else 0
+    return config.TILE_MEMORY_BUDGET_MB * 1024 * 1024 + len(frames) * width * OUTPUT_BYTES_PER_PIXEL
+
+
+def rgb_preview(bgr):
+    """8-bit BGR preview of (H, W, 3) band images with a 2-98 percentile stretch per channel."""
+    rgb = bgr.astype(np.float32, copy=False)
+    lo = np.percentile(rgb, 2, axis=(0, 1))
+    hi = np.percentile(rgb, 98, axis=(0, 1))
+    scale = 255.0 / np.maximum(hi - lo, 1e-5)
+    return np.clip((rgb - lo) * scale, 0, 255).astype(np.uint8)
+
+
+def process_scan(scan_folder, calibration, force=False):
+    """
+    Build cube, NDVI and RGB preview for one scan unless they are up to date.
+
+    Returns:
+        (scan_folder, status, seconds) with status "built" or "skipped"
+    """
+    start = time.time()
+    digest = inputs_hash(scan_folder, calibration)
+    manifest_path = os.path.join(scan_folder, MANIFEST_NAME)
+
+    if not force and os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("hash") == digest and all(
+                os.path.exists(os.path.join(scan_folder, name)) for name in manifest.get("outputs", [])):
+            return scan_folder, "skipped", time.time() - start
+
+    cube = build_cube(scan_folder, os.path.join(scan_folder, CUBE_NAME))
+    outputs = [CUBE_NAME]
+
+    # With a standard band set ("band_set": "sentinel2" in calibration.json),
+    # RGB and NDVI are taken from the resampled cube by wavelength, so they do
+    # not shift when the binning or the smile calibration changes
+    band_set = calibration.get("band_set")
+    if band_set:
+        source = np.load(resample_scan(scan_folder, cube, band_set), mmap_mode="r")
+        outputs.append(resampled_name(band_set))
+        centers = get_resampler(scan_wavelengths(scan_folder, cube.shape[-1]), band_set).centers
+        red, green, blue, nir = select_bands(calibration, centers)
+    else:
+        source = cube
+        red, green, blue, nir = select_bands(calibration)
+
+    # RGB bands and NDVI in one tiled pass over the memmapped cube
+    pipeline = TiledPipeline(CubeHandle.from_array(source))
+    pipeline.add("bgr", lambda tile: tile[..., [blue, green, red]], channels=3)
+    if nir is not None:
+        pipeline.add("ndvi", lambda tile: calculate_ndvi(tile, red, nir),
+                     path=os.path.join(scan_folder, NDVI_NAME))
+    results = pipeline.run()
+
+    cv2.imwrite(os.path.join(scan_folder, RGB_NAME), rgb_preview(results["bgr"]))
+    outputs.append(RGB_NAME)
+
+    if nir is not None:
+        load_plant_mask(scan_folder, source, red, nir, input_digest=digest, ndvi=results["ndvi"])
+        outputs += [NDVI_NAME, PLANT_MASK_NAME]
+
+    with open(manifest_path, "w") as f:
+        json.dump({"hash": digest, "outputs": outputs, "built": time.time()}, f, indent=2)
+
+    return scan_folder, "built", time.time() - start
+
+
+def run_batch(scan_folders, calibration, workers, memory_budget, force=False):
+    """
+    Process scans on a process pool, keeping the summed memory estimate of the
+    running jobs under `memory_budget` (a job that alone exceeds the budget
+    still runs, on its own).
+
+    Returns:
+        dict status -> list of scan folders
+    """
+    pending = sorted((estimate_memory(f), f) for f in scan_folders)
+    total = len(pending)
+    results = {"built": [], "skipped": [], "failed": []}
+    running = {}
+    in_use = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            # Submit the largest jobs that still fit
+            while pending and len(running) < workers:
+                fits = [i for i, (need, _) in enumerate(pending) if in_use + need <= memory_budget]
+                if not fits and running:
+                    break
+                need, folder = pending.pop(fits[-1] if fits else 0)
+                running[pool.submit(process_scan, folder, calibration, force)] = (need, folder)
+                in_use += need
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                need, folder = running.pop(future)
+                in_use -= need
+                try:
+                    _, status, seconds = future.result()
+                except Exception as e:
+                    status, seconds = "failed", 0.0
+                    print(f"[ERROR] {os.path.basename(folder)}: {e}")
+                results[status].append(folder)
+                finished = sum(len(v) for v in results.values())
+                print(f"[{finished}/{total}] {os.path.basename(folder)}: {status} ({seconds:.1f} s)")
+
+    return results
+
+
+def select_scans(args):
+    if args.scans:
+        folders = []
+        for pattern in args.scans:
+            folders.extend(p for p in glob.glob(pattern) if os.path.isdir(p))
+        return sorted(set(os.path.abspath(f) for f in folders))
+
+    catalog = ScanCatalog(args.data_dir)
+    catalog.refresh()
+    since = time.mktime(time.strptime(args.since, "%Y-%m-%d")) if args.since else None
+    until = time.mktime(time.strptime(args.until, "%Y-%m-%d")) + 86399 if args.until else None
+    folders = [scan["path"] for scan in catalog.between(since, until)]
+    catalog.close()
+    return folders
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild cubes, NDVI and RGB previews for many scans.")
+    parser.add_argument("scans", nargs="*", help="Scan folders or glob patterns (default: all catalogued scans)")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Scanner data directory for catalog selection")
+    parser.add_argument("--since", help="Only catalogued scans from this date (YYYY-MM-DD)")
+    parser.add_argument("--until", help="Only catalogued scans up to this date (YYYY-MM-DD)")
+    parser.add_argument("--calibration", default=os.path.join(BASE_DIR, "calibration.json"))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--memory-mb", type=int, default=2048, help="Memory budget for concurrent jobs")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if outputs are up to date")
+    args = parser.parse_args(argv)
+
+    scan_folders = select_scans(args)
+    if not scan_folders:
+        print("No scans selected.")
+        return 1
+
+    calibration = load_calibration(args.calibration)
+    print(f"Processing {len(scan_folders)} scan(s) with {args.workers} worker(s), "
+          f"{args.memory_mb} MB budget")
+
+    start = time.time()
+    results = run_batch(scan_folders, calibration, args.workers, args.memory_mb * 1024 * 1024, args.force)
+
+    # Register rebuilt cubes (single writer, after the pool is done)
+    data_dir = os.path.abspath(args.data_dir)
+    # Scans directly in the data dir or in a per-rig folder below it
+    catalogued = [f for f in results["built"] if os.path.dirname(f) == data_dir
+                  or os.path.dirname(os.path.dirname(f)) == data_dir]
+    if catalogued:
+        catalog = ScanCatalog(data_dir)
+        for folder in catalogued:
+            catalog.register(folder)
+        catalog.close()
+
+    print(f"Done in {time.time() - start:.1f} s: {len(results['built'])} built, "
+          f"{len(results['skipped'])} skipped, {len(results['failed'])} failed")
+    return 1 if results["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
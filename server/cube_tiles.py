@@ -0,0 +1,142 @@
+import os
+import numpy as np
+
+from Generate_cube import CUBE_NAME, frame_cache_size, list_frames
+from utils.frame_codec import read_frame
+from utils import config
+
+# ----------------------------------------------------------------
+#  Out-of-core tiled processing
+# ----------------------------------------------------------------
+# A CubeHandle reads an (H, W, B) cube in row tiles from a memory-mapped
+# .npy or straight from the frame files of a scan (one frame is one row).
+# A TiledPipeline runs registered per-tile operations over the handle and
+# assembles their outputs, choosing the tile height so that one input tile,
+# its float32 working copies and the output rows stay within a memory budget.
+
+# float32 copies of an input tile an operation may make (astype, arithmetic)
+WORK_COPIES = 2
+
+
+class CubeHandle:
+    def __init__(self, shape, dtype, reader):
+        """Use the from_* constructors. `reader(r0, r1)` returns rows r0:r1 as an array."""
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self._reader = reader
+
+    @classmethod
+    def from_array(cls, cube):
+        """Wrap an in-memory array or memmap."""
+        return cls(cube.shape, cube.dtype, lambda r0, r1: np.asarray(cube[r0:r1]))
+
+    @classmethod
+    def from_npy(cls, path):
+        return cls.from_array(np.load(path, mmap_mode="r"))
+
+    @classmethod
+    def from_frames(cls, scan_folder):
+        """Read rows directly from the frame files, without building a cube."""
+        frames = list_frames(scan_folder)
+        if not frames:
+            raise RuntimeError(f"No frames in {scan_folder}")
+        paths = [os.path.join(scan_folder, f) for f in frames]
+        cache_size = frame_cache_size(frames)
+        first = read_frame(paths[0])
+        cache = {}
+
+        def reader(r0, r1):
+            rows = np.zeros((r1 - r0,) + first.shape, dtype=first.dtype)
+            for i, path in enumerate(paths[r0:r1]):
+                img = read_frame(path, cache, cache_size)
+                if img is None:
+                    print(f"[WARNING] Could not read {os.path.basename(path)}, using zeros")
+                    continue
+                rows[i] = img
+            return rows
+
+        return cls((len(paths),) + first.shape, first.dtype, reader)
+
+    @classmethod
+    def open(cls, scan_folder):
+        """The scan's built cube if there is one, otherwise its frames."""
+        cube_path = os.path.join(scan_folder, CUBE_NAME)
+        if os.path.exists(cube_path):
+            return cls.from_npy(cube_path)
+        return cls.from_frames(scan_folder)
+
+    @property
+    def row_nbytes(self):
+        return int(np.prod(self.shape[1:])) * self.dtype.itemsize
+
+    def read_rows(self, r0, r1):
+        return self._reader(r0, min(r1, self.shape[0]))
+
+    def pixel(self, y, x):
+        """Spectrum of one pixel, reading a single row."""
+        return self.read_rows(y, y + 1)[0, x]
+
+    def tiles(self, tile_rows):
+        """Yield (r0, r1, tile) over the cube, `tile_rows` rows at a time."""
+        for r0 in range(0, self.shape[0], tile_rows):
+            r1 = min(r0 + tile_rows, self.shape[0])
+            yield r0, r1, self.read_rows(r0, r1)
+
+
+class TiledPipeline:
+    def __init__(self, handle, memory_budget=None):
+        """
+        Parameters:
+            handle: CubeHandle to process
+            memory_budget: bytes for one tile and its temporaries
+                (default TILE_MEMORY_BUDGET_MB from utils/config.py)
+        """
+        self.handle = handle
+        self.memory_budget = memory_budget or config.TILE_MEMORY_BUDGET_MB * 1024 * 1024
+        self.ops = []
+
+    def add(self, name, func, channels=None, dtype=np.float32, path=None):
+        """
+        Register a per-tile operation.
+
+        Parameters:
+            name: key of the output in run()
+            func: tile (h, W, B) -> (h, W) or (h, W, channels)
+            channels: channels per pixel of the output, None for a 2D output
+            dtype: output dtype
+            path: write the output to this .npy (memmapped) instead of memory
+        """
+        self.ops.append((name, func, channels, np.dtype(dtype), path))
+        return self
+
+    def tile_rows(self):
+        h, w, bands = self.handle.shape
+        per_row = self.handle.row_nbytes + WORK_COPIES * w * bands * 4
+        for _, _, channels, dtype, _ in self.ops:
+            per_row += w * (channels or 1) * dtype.itemsize
+        return int(max(1, min(h, self.memory_budget // per_row)))
+
+    def run(self):
+        """
+        Run all operations in a single pass over the cube.
+
+        Returns:
+            dict name -> assembled output array (memmap for outputs with a path)
+        """
+        h, w = self.handle.shape[:2]
+        outputs = {}
+        for name, _, channels, dtype, path in self.ops:
+            shape = (h, w) if channels is None else (h, w, channels)
+            if path:
+                outputs[name] = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+            else:
+                outputs[name] = np.empty(shape, dtype=dtype)
+
+        for r0, r1, tile in self.handle.tiles(self.tile_rows()):
+            for name, func, _, _, _ in self.ops:
+                outputs[name][r0:r1] = func(tile)
+
+        for name, _, _, _, path in self.ops:
+            if path:
+                outputs[name].flush()
+        return outputs
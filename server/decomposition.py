@@ -0,0 +1,174 @@
+import os
+import numpy as np
+
+from Generate_cube import frame_cache_size, list_frames
+from utils.frame_codec import read_frame
+
+# ----------------------------------------------------------------
+#  Incremental PCA / MNF
+# ----------------------------------------------------------------
+# Only band statistics (sums and B x B cross products) are accumulated, so
+# fitting works frame by frame while a scan streams in, or chunk by chunk
+# from a memory-mapped cube, without ever holding the full cube in memory.
+# A frame is one scan line of shape (W, B), i.e. one row of the (H, W, B) cube.
+
+
+class IncrementalPCA:
+    def __init__(self, n_components=10):
+        self.n_components = n_components
+        self.count = 0
+        self.sum = None
+        self.outer = None
+        self.mean_ = None
+        self.components_ = None           # (B, k) projection matrix
+        self.explained_variance_ = None   # (k,)
+
+    def _accumulate(self, pixels):
+        pixels = pixels.reshape(-1, pixels.shape[-1]).astype(np.float64)
+        if self.sum is None:
+            bands = pixels.shape[1]
+            self.sum = np.zeros(bands)
+            self.outer = np.zeros((bands, bands))
+        self.count += pixels.shape[0]
+        self.sum += pixels.sum(axis=0)
+        self.outer += pixels.T @ pixels
+
+    def partial_fit(self, frame):
+        """
+        Add one frame (W, B), a chunk of cube rows (h, W, B) or a pixel list (N, B).
+        """
+        self._accumulate(frame)
+        return self
+
+    def fit_frames(self, frames):
+        """Fit from an iterable of frames, then solve for the components."""
+        for frame in frames:
+            self.partial_fit(frame)
+        return self.finalize()
+
+    def fit_cube(self, cube, chunk_rows=64):
+        """Fit from an (H, W, B) cube (e.g. a memmap), reading `chunk_rows` rows at a time."""
+        for start in range(0, cube.shape[0], chunk_rows):
+            self.partial_fit(np.asarray(cube[start:start + chunk_rows]))
+        return self.finalize()
+
+    def fit_scan_folder(self, scan_folder):
+        """Fit directly from the frame files of a scan, one frame in memory at a time."""
+        return self.fit_frames(_read_frames(scan_folder))
+
+    def covariance(self):
+        if self.count < 2:
+            raise RuntimeError("Need at least two pixels to estimate covariance.")
+        mean = self.sum / self.count
+        cov = (self.outer - self.count * np.outer(mean, mean)) / (self.count - 1)
+        return mean, cov
+
+    def finalize(self):
+        """Solve for mean, components and explained variance from the accumulated statistics."""
+        self.mean_, cov = self.covariance()
+        eigvals, eigvecs = np.linalg.eigh(cov)
+        order = np.argsort(eigvals)[::-1][:self.n_components]
+        self.explained_variance_ = eigvals[order]
+        self.components_ = eigvecs[:, order]
+        return self
+
+    def transform(self, cube, chunk_rows=64):
+        """
+        Project a cube (H, W, B) or pixel list (N, B) onto the components.
+
+        Returns:
+            np.ndarray (H, W, k) or (N, k) as float32
+        """
+        if self.components_ is None:
+            raise RuntimeError("Model is not fitted.")
+        projection = self.components_.astype(np.float32)
+        mean = self.mean_.astype(np.float32)
+
+        out = np.empty(cube.shape[:-1] + (projection.shape[1],), dtype=np.float32)
+        for start in range(0, cube.shape[0], chunk_rows):
+            chunk = np.asarray(cube[start:start + chunk_rows], dtype=np.float32)
+            out[start:start + chunk_rows] = (chunk - mean) @ projection
+        return out
+
+    def inverse_transform(self, scores):
+        return scores @ self.components_.T.astype(np.float32) + self.mean_.astype(np.float32)
+
+    def save(self, path):
+        np.savez(path, **{k: v for k, v in self._state().items() if v is not None})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            model = cls(int(data["n_components"]))
+            for key in data.files:
+                if key != "n_components":
+                    setattr(model, key, data[key] if data[key].ndim else data[key].item())
+        return model
+
+    def _state(self):
+        return {
+            "n_components": self.n_components, "count": self.count, "sum": self.sum, "outer": self.outer,
+            "mean_": self.mean_, "components_": self.components_,
+            "explained_variance_": self.explained_variance_,
+        }
+
+
+class IncrementalMNF(IncrementalPCA):
+    """
+    Minimum noise fraction: components ordered by signal-to-noise ratio.
+
+    Noise covariance is estimated from differences between neighbouring
+    pixels along each frame (shift-difference), so frames must be passed
+    with their spatial axis intact, i.e. (W, B) or (h, W, B).
+    """
+
+    def __init__(self, n_components=10):
+        super().__init__(n_components)
+        self.noise_count = 0
+        self.noise_outer = None
+
+    def partial_fit(self, frame):
+        if frame.ndim < 2:
+            raise ValueError("MNF needs frames (W, B) or cube rows (h, W, B).")
+        self._accumulate(frame)
+
+        diff = np.diff(frame.astype(np.float64), axis=-2).reshape(-1, frame.shape[-1])
+        if self.noise_outer is None:
+            self.noise_outer = np.zeros((frame.shape[-1], frame.shape[-1]))
+        self.noise_count += diff.shape[0]
+        self.noise_outer += diff.T @ diff
+        return self
+
+    def finalize(self):
+        self.mean_, cov = self.covariance()
+        # Differences of neighbours carry twice the noise variance
+        noise_cov = self.noise_outer / (2.0 * max(self.noise_count, 1))
+
+        # Whiten the noise, then PCA in the whitened space
+        noise_vals, noise_vecs = np.linalg.eigh(noise_cov)
+        noise_vals = np.maximum(noise_vals, noise_vals.max() * 1e-12)
+        whiten = noise_vecs / np.sqrt(noise_vals)
+
+        snr, vecs = np.linalg.eigh(whiten.T @ cov @ whiten)
+        order = np.argsort(snr)[::-1][:self.n_components]
+        self.explained_variance_ = snr[order]
+        self.components_ = whiten @ vecs[:, order]
+        return self
+
+    def inverse_transform(self, scores):
+        return scores @ np.linalg.pinv(self.components_).astype(np.float32) + self.mean_.astype(np.float32)
+
+    def _state(self):
+        state = super()._state()
+        state.update(noise_count=self.noise_count, noise_outer=self.noise_outer)
+        return state
+
+
+def _read_frames(scan_folder):
+    frames = list_frames(scan_folder)
+    cache_size = frame_cache_size(frames)
+    cache = {}
+    for fname in frames:
+        frame = read_frame(os.path.join(scan_folder, fname), cache, cache_size)
+        if frame is not None:
+            yield frame
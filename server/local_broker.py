@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import queue
+import tarfile
+import tempfile
+import threading
+import numpy as np
+
+from edge.Scan import frame_name, scan_folder_name
+from edge.topics import rig_topics, tarball_name
+
+# ----------------------------------------------------------------
+#  In-process MQTT stand-in
+# ----------------------------------------------------------------
+# A tiny Mosquitto-like broker (topic wildcards, retained messages) and a
+# client exposing the subset of the paho-mqtt API the project uses, so the
+# orchestrator can be exercised with simulated edges and no real broker.
+
+
+def topic_matches(pattern, topic):
+    """MQTT topic filter match with `+` and `#` wildcards."""
+    p_parts = pattern.split("/")
+    t_parts = topic.split("/")
+    for i, p in enumerate(p_parts):
+        if p == "#":
+            return True
+        if i >= len(t_parts) or (p != "+" and p != t_parts[i]):
+            return False
+    return len(p_parts) == len(t_parts)
+
+
+class Message:
+    def __init__(self, topic, payload, retain=False):
+        self.topic = topic
+        self.payload = payload
+        self.retain = retain
+
+
+class LocalBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = []   # (client, pattern)
+        self._retained = {}
+
+    def subscribe(self, client, pattern):
+        with self._lock:
+            self._subscriptions.append((client, pattern))
+            retained = [m for t, m in self._retained.items() if topic_matches(pattern, t)]
+        for msg in retained:
+            client._deliver(msg)
+
+    def unsubscribe_all(self, client):
+        with self._lock:
+            self._subscriptions = [(c, p) for c, p in self._subscriptions if c is not client]
+
+    def publish(self, topic, payload, retain=False):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        msg = Message(topic, payload, retain)
+        with self._lock:
+            if retain:
+                if payload:
+                    self._retained[topic] = Message(topic, payload, True)
+                else:
+                    self._retained.pop(topic, None)
+            targets = {id(c): c for c, p in self._subscriptions if topic_matches(p, topic)}
+        for client in targets.values():
+            client._deliver(Message(topic, payload, False))
+
+
+class LocalClient:
+    """paho-mqtt style client bound to a LocalBroker; callbacks run on its own thread."""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.on_connect = None
+        self.on_message = None
+        self._inbox = queue.Queue()
+        self._thread = None
+
+    def connect(self, host=None, port=None, keepalive=60):
+        self._inbox.put(("connect", None))
+
+    def subscribe(self, topic, qos=0):
+        self.broker.subscribe(self, topic)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.broker.publish(topic, payload or b"", retain=retain)
+
+    def loop_start(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def loop_stop(self):
+        self._inbox.put(("stop", None))
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def disconnect(self):
+        self.broker.unsubscribe_all(self)
+
+    def _deliver(self, msg):
+        self._inbox.put(("message", msg))
+
+    def _loop(self):
+        while True:
+            kind, msg = self._inbox.get()
+            if kind == "stop":
+                return
+            try:
+                if kind == "connect" and self.on_connect:
+                    self.on_connect(self, None, {}, 0)
+                elif kind == "message" and self.on_message:
+                    self.on_message(self, None, msg)
+            except Exception as e:
+                print(f"[ERROR] Callback failed: {e}")
+
+
+# ----------------------------------------------------------------
+#  Simulated edge scanner
+# ----------------------------------------------------------------
+class SimulatedEdge:
+    """
+    Behaves like edge/mqtt.py on the wire: announces itself, accepts scan
+    commands, reports scanning/idle status, drops a scan tarball into
+    `incoming_dir` (standing in for the SCP upload) and publishes the result.
+    """
+
+    def __init__(self, broker, rig_id, incoming_dir, n_frames=8, frame_shape=(32, 48), scan_seconds=1.0):
+        self.rig_id = rig_id
+        self.incoming_dir = incoming_dir
+        self.n_frames = n_frames
+        self.frame_shape = frame_shape
+        self.scan_seconds = scan_seconds
+        self.topics = rig_topics(rig_id)
+        self.client = LocalClient(broker)
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.scans = 0
+
+    def start(self):
+        self.client.connect()
+        self.client.loop_start()
+
+    def stop(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def on_connect(self, client, userdata, flags, rc):
+        client.subscribe(self.topics["scan_command"])
+        client.publish(self.topics["announce"], json.dumps({"rig_id": self.rig_id, "topics": self.topics}),
+                       retain=True)
+        client.publish(self.topics["status"], json.dumps({"status": "idle"}), retain=True)
+
+    def on_message(self, client, userdata, msg):
+        payload = json.loads(msg.payload.decode())
+        threading.Thread(target=self._scan, args=(payload,), daemon=True).start()
+
+    def _scan(self, payload):
+        import cv2
+
+        self.client.publish(self.topics["status"], json.dumps({"status": "scanning", "job_id": payload.get("job_id")}))
+        time.sleep(self.scan_seconds)
+
+        # Real edge naming: scan folders have one-second resolution, so a
+        # simulated scan has to take at least a second as well
+        self.scans += 1
+        scan_name = scan_folder_name()
+        rng = np.random.default_rng(self.scans)
+        with tempfile.TemporaryDirectory() as tmp:
+            scan_dir = os.path.join(tmp, scan_name)
+            os.makedirs(scan_dir)
+            for z in range(self.n_frames):
+                frame = rng.integers(0, 255, self.frame_shape, dtype=np.uint8)
+                cv2.imwrite(os.path.join(scan_dir, frame_name(100, z / 10)), frame)
+            tarball = os.path.join(self.incoming_dir, tarball_name(self.rig_id, scan_name))
+            with tarfile.open(tarball, "w:gz") as tar:
+                tar.add(scan_dir, arcname=scan_name)
+
+        self.client.publish(self.topics["status"], json.dumps({
+            "status": "idle", "job_id": payload.get("job_id"), "scan_tarball": tarball}))
+        self.client.publish(self.topics["scan_result"], json.dumps({
+            "job_id": payload.get("job_id"), "result": "done", "scan_tarball": tarball}))
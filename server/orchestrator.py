@@ -0,0 +1,318 @@
+import os
+import sys
+import json
+import time
+import uuid
+import tarfile
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from batch_reprocess import load_calibration, process_scan
+from scan_catalog import DATA_DIR, ScanCatalog
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# ----------------------------------------------------------------
+#  Multi-scanner orchestration
+# ----------------------------------------------------------------
+# Every edge rig publishes a retained announcement on
+# `status/gf/<rig_id>/announce` with its topic map. The orchestrator
+# discovers rigs from those, keeps one job queue per rig (a rig runs one
+# scan at a time), and ingests finished scans concurrently: each tarball is
+# unpacked into `<data_dir>/<rig_id>/` and run through the batch pipeline
+# (cube, NDVI, RGB preview) on a process pool.
+#
+# A job is finished only by a message on the rig's scan result topic that
+# carries its job_id. Status updates are deltas from a long-lived merged
+# state (config changes, debug pictures, ...), so they only track progress.
+
+ANNOUNCE_FILTER = "status/gf/+/announce"
+INCOMING_DIR = "/home/kybfarm/kybfarm/server/homeassistant/config/HSI/scanner_data"
+JOB_TIMEOUT = 4 * 3600  # seconds from dispatch until a silent job is failed
+
+
+class ScanJob:
+    def __init__(self, rig_id, params):
+        self.id = uuid.uuid4().hex[:12]
+        self.rig_id = rig_id
+        self.params = params
+        self.state = "queued"   # queued -> scanning -> ingesting -> done | failed
+        self.scan_folder = None
+        self.error = None
+        self.deadline = None
+        self.done = threading.Event()
+
+
+class Rig:
+    def __init__(self, rig_id, topics):
+        self.rig_id = rig_id
+        self.topics = topics
+        self.queue = deque()
+        self.current = None
+        self.status = {}   # merged status of the current job (snapshots and delta updates)
+
+
+def ingest_scan(tarball, rig_dir, calibration):
+    """Unpack a scan tarball into the rig's data directory and build its outputs."""
+    os.makedirs(rig_dir, exist_ok=True)
+    with tarfile.open(tarball, "r:gz") as tar:
+        names = {m.name.split("/")[0] for m in tar.getmembers()}
+        if len(names) != 1:
+            raise ValueError(f"{tarball} should contain exactly one scan folder")
+        tar.extractall(rig_dir, filter="data")
+    scan_folder = os.path.join(rig_dir, names.pop())
+    process_scan(scan_folder, calibration)
+    return scan_folder
+
+
+class ScanOrchestrator:
+    def __init__(self, client, data_dir=DATA_DIR, incoming_dir=INCOMING_DIR,
+                 calibration=None, ingest_workers=2, job_timeout=JOB_TIMEOUT):
+        self.client = client
+        self.data_dir = data_dir
+        self.incoming_dir = incoming_dir
+        self.calibration = calibration
+        self.job_timeout = job_timeout
+        self.rigs = {}
+        self.jobs = {}
+        self._lock = threading.RLock()
+        self._ingest = ProcessPoolExecutor(max_workers=ingest_workers)
+        self._stopped = threading.Event()
+        self._watchdog = threading.Thread(target=self._check_deadlines, daemon=True)
+
+    def start(self, host=None, port=1883):
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.connect(host, port, 60)
+        self.client.loop_start()
+        self._watchdog.start()
+
+    def stop(self):
+        self._stopped.set()
+        self.client.loop_stop()
+        self.client.disconnect()
+        self._ingest.shutdown(wait=True)
+
+    def _check_deadlines(self):
+        """Fail jobs whose rig went silent, so the rig's queue moves on."""
+        while not self._stopped.wait(min(5.0, self.job_timeout)):
+            expired = []
+            with self._lock:
+                for rig in self.rigs.values():
+                    job = rig.current
+                    if job is not None and job.deadline is not None and time.time() > job.deadline:
+                        self._finish(rig, job, error=f"no result within {self.job_timeout:.0f} s")
+                        expired.append(rig.rig_id)
+            for rig_id in expired:
+                self._dispatch(rig_id)
+
+    # ------------------------------------------------------------
+    #  MQTT callbacks
+    # ------------------------------------------------------------
+    def on_connect(self, client, userdata, flags, rc):
+        print("Orchestrator connected, discovering rigs...")
+        client.subscribe(ANNOUNCE_FILTER)
+        with self._lock:
+            for rig in self.rigs.values():
+                client.subscribe(rig.topics["status"])
+                client.subscribe(rig.topics["scan_result"])
+
+    def on_message(self, client, userdata, msg):
+        try:
+            payload = json.loads(msg.payload.decode())
+        except ValueError:
+            return
+        parts = msg.topic.split("/")
+        if len(parts) == 4 and parts[3] == "announce":
+            self._on_announce(payload)
+            return
+        with self._lock:
+            rig = next((r for r in self.rigs.values()
+                        if msg.topic in (r.topics["status"], r.topics["scan_result"])), None)
+            if rig is None:
+                return
+            if msg.topic == rig.topics["scan_result"]:
+                self._on_result(rig, payload)
+            else:
+                self._on_status(rig, payload)
+        self._dispatch(rig.rig_id)
+
+    def _on_announce(self, payload):
+        rig_id = payload["rig_id"]
+        with self._lock:
+            known = self.rigs.get(rig_id)
+            if known is None:
+                self.rigs[rig_id] = Rig(rig_id, payload["topics"])
+                print(f"Discovered rig '{rig_id}'")
+            else:
+                known.topics = payload["topics"]
+        self.client.subscribe(payload["topics"]["status"])
+        self.client.subscribe(payload["topics"]["scan_result"])
+        self._dispatch(rig_id)
+
+    def _on_status(self, rig, payload):
+        rig.status.update(payload)
+        job = rig.current
+        if job is not None and rig.status.get("job_id") == job.id and rig.status.get("status") == "scanning":
+            job.state = "scanning"
+
+    def _on_result(self, rig, payload):
+        job = rig.current
+        if job is None or payload.get("job_id") != job.id:
+            return
+
+        if payload.get("result") != "done":
+            self._finish(rig, job, error=payload.get("error", f"edge reported '{payload.get('result')}'"))
+        elif not payload.get("scan_tarball"):
+            self._finish(rig, job, error="edge finished without a scan tarball")
+        else:
+            tarball = os.path.join(self.incoming_dir, os.path.basename(payload["scan_tarball"]))
+            job.state = "ingesting"
+            rig.current = None
+            future = self._ingest.submit(ingest_scan, tarball, os.path.join(self.data_dir, rig.rig_id),
+                                         self.calibration)
+            future.add_done_callback(lambda f, rig=rig, job=job: self._on_ingested(rig, job, f))
+
+    def _on_ingested(self, rig, job, future):
+        try:
+            job.scan_folder = future.result()
+        except Exception as e:
+            job.error = str(e)
+            job.state = "failed"
+            print(f"[ERROR] Ingest of job {job.id} from '{rig.rig_id}' failed: {e}")
+        else:
+            # One short-lived connection per registration; callbacks run on pool threads.
+            # The shared catalog indexes <data_dir>/<rig_id>/scan_* for the dashboard scripts.
+            catalog = ScanCatalog(self.data_dir)
+            catalog.register(job.scan_folder)
+            catalog.close()
+            job.state = "done"
+            print(f"Job {job.id} from '{rig.rig_id}' ingested: {job.scan_folder}")
+        job.done.set()
+
+    def _finish(self, rig, job, error):
+        job.state = "failed"
+        job.error = error
+        rig.current = None
+        job.done.set()
+        print(f"[ERROR] Job {job.id} on '{rig.rig_id}' failed: {error}")
+
+    # ------------------------------------------------------------
+    #  Scheduling
+    # ------------------------------------------------------------
+    def submit(self, rig_id=None, params=None):
+        """
+        Queue a scan. Without `rig_id`, the rig with the least queued work is used.
+
+        Returns:
+            ScanJob; wait on `job.done` for completion
+        """
+        with self._lock:
+            if not self.rigs:
+                raise RuntimeError("No rigs discovered yet.")
+            if rig_id is None:
+                rig_id = min(self.rigs.values(),
+                             key=lambda r: len(r.queue) + (r.current is not None)).rig_id
+            job = ScanJob(rig_id, params or {})
+            self.jobs[job.id] = job
+            self.rigs[rig_id].queue.append(job)
+        self._dispatch(rig_id)
+        return job
+
+    def _dispatch(self, rig_id):
+        with self._lock:
+            rig = self.rigs.get(rig_id)
+            if rig is None or rig.current is not None or not rig.queue:
+                return
+            job = rig.queue.popleft()
+            job.state = "sent"
+            job.deadline = time.time() + self.job_timeout
+            rig.current = job
+            rig.status = {}  # statuses from before this job say nothing about it
+        payload = dict(job.params, job_id=job.id)
+        self.client.publish(rig.topics["scan_command"], json.dumps(payload))
+        print(f"Dispatched job {job.id} to '{rig_id}'")
+
+    def wait(self, jobs, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        for job in jobs:
+            remaining = None if deadline is None else max(deadline - time.time(), 0)
+            if not job.done.wait(remaining):
+                return False
+        return True
+
+
+def simulate(n_rigs, scans_per_rig, data_dir, calibration):
+    """Run the orchestrator against a local broker and simulated edges."""
+    import tempfile
+    from local_broker import LocalBroker, LocalClient, SimulatedEdge
+
+    broker = LocalBroker()
+    incoming = tempfile.mkdtemp(prefix="kfspectra_incoming_")
+    # Enough bands per simulated frame for every band index the calibration uses
+    n_bands = max([48] + [v + 1 for k, v in calibration.items() if k.endswith("_band")])
+    edges = [SimulatedEdge(broker, f"rig{i + 1}", incoming, frame_shape=(32, n_bands)) for i in range(n_rigs)]
+    for edge in edges:
+        edge.start()
+
+    orchestrator = ScanOrchestrator(LocalClient(broker), data_dir, incoming, calibration)
+    orchestrator.start()
+    while len(orchestrator.rigs) < n_rigs:
+        time.sleep(0.05)
+
+    start = time.time()
+    jobs = [orchestrator.submit() for _ in range(n_rigs * scans_per_rig)]
+    orchestrator.wait(jobs, timeout=120)
+    print(f"\n{sum(j.state == 'done' for j in jobs)}/{len(jobs)} scans done in {time.time() - start:.1f} s")
+
+    orchestrator.stop()
+    for edge in edges:
+        edge.stop()
+    return jobs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Schedule scans across several scanner rigs.")
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--incoming-dir", default=INCOMING_DIR, help="Where edges upload scan tarballs")
+    parser.add_argument("--calibration", default=os.path.join(BASE_DIR, "calibration.json"))
+    parser.add_argument("--simulate", type=int, metavar="N", help="Run with N simulated rigs on a local broker")
+    parser.add_argument("--scans", type=int, default=2, help="Scans per rig in simulation")
+    parser.add_argument("--job-timeout", type=float, default=JOB_TIMEOUT,
+                        help="Seconds after dispatch before a job without result is failed")
+    args = parser.parse_args(argv)
+
+    calibration = load_calibration(args.calibration)
+
+    if args.simulate:
+        jobs = simulate(args.simulate, args.scans, args.data_dir, calibration)
+        return 0 if all(j.state == "done" for j in jobs) else 1
+
+    import paho.mqtt.client as mqtt
+    orchestrator = ScanOrchestrator(mqtt.Client(), args.data_dir, args.incoming_dir, calibration,
+                                    job_timeout=args.job_timeout)
+    orchestrator.start(args.broker, args.port)
+    print("Orchestrator running. Type a rig id (or empty for any) to queue a scan, 'exit' to quit.")
+    try:
+        while True:
+            line = input("> ").strip()
+            if line == "exit":
+                break
+            try:
+                job = orchestrator.submit(line or None)
+                print(f"Queued job {job.id} on '{job.rig_id}'")
+            except (RuntimeError, KeyError) as e:
+                print(f"[ERROR] {e}")
+    except (KeyboardInterrupt, EOFError):
+        pass
+    finally:
+        orchestrator.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
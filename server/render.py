@@ -0,0 +1,138 @@
+import os
+import functools
+import numpy as np
+import cv2
+
+# ----------------------------------------------------------------
+#  Headless rendering backend
+# ----------------------------------------------------------------
+# Raster outputs (bands, NDVI maps) are colour-mapped with a 256-entry LUT
+# and encoded with cv2.imencode, without touching matplotlib. Matplotlib is
+# imported lazily and only for line plots, which reuse one figure.
+
+# Colormap anchors as (position, (R, G, B))
+COLORMAP_ANCHORS = {
+    "gray": [(0.0, (0, 0, 0)), (1.0, (255, 255, 255))],
+    "ndvi": [(0.0, (165, 0, 38)), (0.25, (244, 109, 67)), (0.5, (255, 255, 191)),
+             (0.75, (102, 189, 99)), (1.0, (0, 104, 55))],
+    "viridis": [(0.0, (68, 1, 84)), (0.25, (59, 82, 139)), (0.5, (33, 145, 140)),
+                (0.75, (94, 201, 98)), (1.0, (253, 231, 37))],
+}
+
+PNG_COMPRESSION = 1  # fast; dashboard images are rewritten on every refresh
+
+
+@functools.lru_cache(maxsize=None)
+def colormap_lut(name):
+    """(256, 3) uint8 BGR lookup table for a named colormap."""
+    anchors = COLORMAP_ANCHORS[name]
+    pos = np.array([a[0] for a in anchors])
+    rgb = np.array([a[1] for a in anchors], dtype=np.float64)
+    x = np.linspace(0.0, 1.0, 256)
+    lut = np.stack([np.interp(x, pos, rgb[:, c]) for c in range(3)], axis=1)
+    return np.round(lut[:, ::-1]).astype(np.uint8)
+
+
+def to_uint8(img, vmin=None, vmax=None, percentiles=(2, 98)):
+    """
+    Scale an image to 0-255. Missing limits come from percentiles of the
+    finite pixels; NaNs map to 0.
+    """
+    img = np.asarray(img, dtype=np.float32)
+    finite = np.isfinite(img)
+    if vmin is None or vmax is None:
+        lo, hi = np.percentile(img[finite], percentiles) if finite.any() else (0.0, 1.0)
+        vmin = lo if vmin is None else vmin
+        vmax = hi if vmax is None else vmax
+    scale = 255.0 / max(vmax - vmin, 1e-6)
+    out = np.clip((img - vmin) * scale, 0, 255)
+    out[~finite] = 0
+    return out.astype(np.uint8)
+
+
+def colorize(img, cmap="gray", vmin=None, vmax=None):
+    """Colour-map a 2D array to a BGR uint8 image through the LUT."""
+    idx = to_uint8(img, vmin, vmax)
+    if cmap == "gray":
+        return idx
+    return colormap_lut(cmap)[idx]
+
+
+def write_png(path, image, compression=PNG_COMPRESSION):
+    """Encode and write a PNG, replacing the old file atomically."""
+    ok, buf = cv2.imencode(".png", image, [cv2.IMWRITE_PNG_COMPRESSION, compression])
+    if not ok:
+        raise RuntimeError(f"PNG encoding failed for {path}")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(buf.tobytes())
+    os.replace(tmp_path, path)
+    return path
+
+
+class SpectrumPlotter:
+    """Line plots on a single reused matplotlib figure."""
+
+    def __init__(self, figsize=(8, 4), dpi=100):
+        import matplotlib
+        matplotlib.use("Agg")
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        self.figure = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot(1, 1, 1)
+        (self.line,) = self.ax.plot([], [])
+        self.ax.set_ylabel("Intensity")
+        self.ax.grid(True)
+        self.figure.tight_layout()
+
+    def save(self, spectrum, output_path, wavelengths=None, title="Spectral Signature"):
+        x = np.arange(len(spectrum)) if wavelengths is None else wavelengths
+        self.line.set_data(x, spectrum)
+        self.ax.set_xlabel("Wavelength (nm)" if wavelengths is not None else "Band index")
+        self.ax.set_title(title)
+        self.ax.relim()
+        self.ax.autoscale_view()
+        self.figure.savefig(output_path)
+        return output_path
+
+
+class BatchRenderer:
+    """
+    Queue raster images and spectrum plots, then write them in one go.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.rasters = []
+        self.spectra = []
+        self._plotter = None
+
+    def add_band(self, cube, band_idx, name=None):
+        self.rasters.append((name or f"band_{band_idx}.png", cube[:, :, band_idx], "gray", None, None))
+
+    def add_ndvi(self, ndvi, name="ndvi.png"):
+        self.rasters.append((name, ndvi, "ndvi", -1.0, 1.0))
+
+    def add_image(self, img, name, cmap="gray", vmin=None, vmax=None):
+        self.rasters.append((name, img, cmap, vmin, vmax))
+
+    def add_spectrum(self, spectrum, name, wavelengths=None, title="Spectral Signature"):
+        self.spectra.append((name, spectrum, wavelengths, title))
+
+    def render(self):
+        """Write all queued outputs. Returns the written paths."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        written = []
+        for name, img, cmap, vmin, vmax in self.rasters:
+            written.append(write_png(os.path.join(self.output_dir, name), colorize(img, cmap, vmin, vmax)))
+
+        if self.spectra and self._plotter is None:
+            self._plotter = SpectrumPlotter()
+        for name, spectrum, wavelengths, title in self.spectra:
+            written.append(self._plotter.save(spectrum, os.path.join(self.output_dir, name), wavelengths, title))
+
+        self.rasters.clear()
+        self.spectra.clear()
+        return written
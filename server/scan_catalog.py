@@ -0,0 +1,315 @@
+import os
+import re
+import json
+import sqlite3
+import zipfile
+import datetime
+import numpy as np
+
+# ----------------------------------------------------------------
+#  Scan catalog
+# ----------------------------------------------------------------
+# SQLite index of the scan folders on the server. Folders are only stat'ed
+# on refresh and re-indexed when their mtime changes, so finding the latest
+# scan or a time range is a single query instead of a directory listing.
+# Cube file offsets are stored so time series can be read lazily through
+# np.memmap without loading whole cubes.
+
+DATA_DIR = "/home/kybfarm/kybfarm/server/homeassistant/config/HSI/scanner_data"
+CATALOG_NAME = "scan_catalog.sqlite"
+CUBE_FILES = ("hyperspectral_cube.npy", "hyperspectral_cube.npz")
+META_FILE = "scan_meta.json"
+
+FRAME_PATTERN = re.compile(r"^X(\d+)_Z(\d+)\.(png|tiff|npy|kfd)$")
+SCAN_TIME_FORMATS = ("scan_%Y%m%d_%H%M%S", "scan_%d%B_%H:%M:%S")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    path TEXT NOT NULL,
+    scan_time REAL NOT NULL,
+    folder_mtime REAL NOT NULL,
+    n_frames INTEGER NOT NULL,
+    grid TEXT,
+    config TEXT,
+    calibration TEXT,
+    cube_path TEXT,
+    cube_offset INTEGER,
+    cube_dtype TEXT,
+    cube_shape TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_scans_time ON scans(scan_time);
+"""
+
+
+def parse_scan_time(name, mtime):
+    """
+    Scan timestamp from a folder name, as epoch seconds.
+
+    Older folders are named `scan_30April_17:40:21` (no year); the year is
+    taken from the folder mtime. Falls back to the mtime itself.
+    """
+    for fmt in SCAN_TIME_FORMATS:
+        try:
+            t = datetime.datetime.strptime(name, fmt)
+        except ValueError:
+            continue
+        if "%Y" not in fmt:
+            year = datetime.datetime.fromtimestamp(mtime).year
+            t = t.replace(year=year)
+            if t.timestamp() > mtime + 86400:
+                t = t.replace(year=year - 1)
+        return t.timestamp()
+    return mtime
+
+
+def parse_frame_name(fname):
+    """(x_mm, z_mm) from a frame name like X100_Z205.png (any frame codec), or None."""
+    m = FRAME_PATTERN.match(fname)
+    if not m:
+        return None
+    return int(m.group(1)) / 10.0, int(m.group(2)) / 10.0
+
+
+def _read_npy_header(f):
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        return np.lib.format.read_array_header_1_0(f)
+    return np.lib.format.read_array_header_2_0(f)
+
+
+def cube_layout(path):
+    """
+    (offset, dtype, shape) of the cube array inside a .npy or .npz file.
+    Offset is None when the array is compressed and cannot be memory-mapped.
+    """
+    if path.endswith(".npy"):
+        with open(path, "rb") as f:
+            shape, fortran, dtype = _read_npy_header(f)
+            return (None if fortran else f.tell()), dtype.str, shape
+
+    with zipfile.ZipFile(path) as zf:
+        info = zf.getinfo("cube.npy")
+        with zf.open(info) as member:
+            shape, fortran, dtype = _read_npy_header(member)
+            header_len = member.tell()
+        if info.compress_type != zipfile.ZIP_STORED or fortran:
+            return None, dtype.str, shape
+
+    # Data starts after the local zip header and the npy header
+    with open(path, "rb") as f:
+        f.seek(info.header_offset + 26)
+        name_len, extra_len = np.frombuffer(f.read(4), dtype="<u2")
+    return info.header_offset + 30 + int(name_len) + int(extra_len) + header_len, dtype.str, shape
+
+
+class ScanCatalog:
+    def __init__(self, data_dir=DATA_DIR, db_path=None):
+        self.data_dir = data_dir
+        self.db_path = db_path or os.path.join(data_dir, CATALOG_NAME)
+        self.db = sqlite3.connect(self.db_path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    # ------------------------------------------------------------
+    #  Indexing
+    # ------------------------------------------------------------
+    def refresh(self):
+        """
+        Index new or modified scan folders and drop vanished ones.
+
+        Returns:
+            Number of folders (re)indexed
+        """
+        known = {row["name"]: row["folder_mtime"]
+                 for row in self.db.execute("SELECT name, folder_mtime FROM scans")}
+        seen = set()
+        indexed = 0
+
+        for name, path, mtime in self._scan_folders():
+            seen.add(name)
+            if known.get(name) != mtime:
+                self._index(path, commit=False)
+                indexed += 1
+
+        for name in set(known) - seen:
+            self.db.execute("DELETE FROM scans WHERE name = ?", (name,))
+        self.db.commit()
+        return indexed
+
+    def _scan_folders(self):
+        """
+        (name, path, mtime) of the scan folders directly in data_dir and one
+        level down in per-rig folders (`<data_dir>/<rig_id>/scan_*`, written
+        by the orchestrator). Names are relative to data_dir.
+        """
+        with os.scandir(self.data_dir) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                if entry.name.startswith("scan_"):
+                    yield entry.name, entry.path, entry.stat().st_mtime
+                    continue
+                with os.scandir(entry.path) as rig_entries:
+                    for scan in rig_entries:
+                        if scan.name.startswith("scan_") and scan.is_dir():
+                            yield f"{entry.name}/{scan.name}", scan.path, scan.stat().st_mtime
+
+    def scan_name(self, scan_folder):
+        """Catalog name of a scan folder (its path relative to data_dir)."""
+        rel = os.path.relpath(scan_folder, os.path.abspath(self.data_dir))
+        if rel.startswith(os.pardir):
+            return os.path.basename(scan_folder.rstrip(os.sep))
+        return rel.replace(os.sep, "/")
+
+    def register(self, scan_folder):
+        """Index (or re-index) a single scan folder, e.g. right after building its cube."""
+        self._index(os.path.abspath(scan_folder), commit=True)
+
+    def _index(self, scan_folder, commit):
+        name = self.scan_name(scan_folder)
+        mtime = os.stat(scan_folder).st_mtime
+
+        xs, zs, n_frames = set(), set(), 0
+        cube_files = set()
+        for fname in os.listdir(scan_folder):
+            pos = parse_frame_name(fname)
+            if pos:
+                xs.add(pos[0])
+                zs.add(pos[1])
+                n_frames += 1
+            elif fname in CUBE_FILES:
+                cube_files.add(fname)
+
+        # Prefer the memory-mappable .npy over a legacy .npz
+        cube_path = next((os.path.join(scan_folder, f) for f in CUBE_FILES if f in cube_files), None)
+
+        grid = {"x": sorted(xs), "z": sorted(zs)}
+
+        meta = {}
+        meta_path = os.path.join(scan_folder, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+
+        offset, dtype, shape = None, None, None
+        if cube_path:
+            offset, dtype, shape = cube_layout(cube_path)
+
+        self.db.execute(
+            """INSERT INTO scans (name, path, scan_time, folder_mtime, n_frames, grid, config,
+                                  calibration, cube_path, cube_offset, cube_dtype, cube_shape)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT(name) DO UPDATE SET
+                   path = excluded.path, scan_time = excluded.scan_time,
+                   folder_mtime = excluded.folder_mtime, n_frames = excluded.n_frames,
+                   grid = excluded.grid, config = excluded.config,
+                   calibration = excluded.calibration, cube_path = excluded.cube_path,
+                   cube_offset = excluded.cube_offset, cube_dtype = excluded.cube_dtype,
+                   cube_shape = excluded.cube_shape""",
+            (name, scan_folder, parse_scan_time(os.path.basename(name), mtime), mtime, n_frames,
+             json.dumps(grid), json.dumps(meta.get("config")), json.dumps(meta.get("calibration")),
+             cube_path, offset, dtype, json.dumps(shape) if shape else None),
+        )
+        if commit:
+            self.db.commit()
+
+    # ------------------------------------------------------------
+    #  Queries
+    # ------------------------------------------------------------
+    def latest(self, with_cube=False):
+        """Most recent scan (optionally the most recent one with a cube), or None."""
+        where = "WHERE cube_path IS NOT NULL" if with_cube else ""
+        return self.db.execute(f"SELECT * FROM scans {where} ORDER BY scan_time DESC LIMIT 1").fetchone()
+
+    def get(self, name):
+        return self.db.execute("SELECT * FROM scans WHERE name = ?", (name,)).fetchone()
+
+    def between(self, start=None, end=None, with_cube=False):
+        """
+        Scans in a time range, oldest first.
+
+        Parameters:
+            start, end: datetime or epoch seconds (inclusive), None for open-ended
+        """
+        query = "SELECT * FROM scans WHERE scan_time >= ? AND scan_time <= ?"
+        if with_cube:
+            query += " AND cube_path IS NOT NULL"
+        return self.db.execute(query + " ORDER BY scan_time",
+                               (_epoch(start, float("-inf")), _epoch(end, float("inf")))).fetchall()
+
+    # ------------------------------------------------------------
+    #  Lazy cube access
+    # ------------------------------------------------------------
+    def open_cube(self, scan):
+        """
+        Cube of a catalog row as a read-only memmap (or a loaded array for
+        compressed legacy .npz files).
+        """
+        if scan["cube_path"] is None:
+            raise FileNotFoundError(f"No cube built for {scan['name']}")
+        if scan["cube_offset"] is None:
+            if scan["cube_path"].endswith(".npz"):
+                with np.load(scan["cube_path"]) as data:
+                    return data["cube"]
+            return np.load(scan["cube_path"])
+        return np.memmap(scan["cube_path"], dtype=np.dtype(scan["cube_dtype"]), mode="r",
+                         offset=scan["cube_offset"], shape=tuple(json.loads(scan["cube_shape"])))
+
+    def roi_series(self, x0, y0, x1, y1, start=None, end=None, band_set=None):
+        """
+        Mean spectrum of a rectangle for every scan in a time range.
+
+        Parameters:
+            x0, y0, x1, y1: ROI bounds in cube pixels (end-exclusive)
+            start, end: optional time range
+            band_set: read the scans' cubes resampled to this band set (see
+                band_resampling.py), so scans with different binning line up;
+                scans without that resampled cube are skipped
+
+        Returns:
+            times (N,) epoch seconds, spectra (N, B) float32
+        """
+        times, spectra = [], []
+        for scan in self.between(start, end, with_cube=True):
+            if band_set:
+                from band_resampling import resampled_name
+                path = os.path.join(scan["path"], resampled_name(band_set))
+                if not os.path.exists(path):
+                    continue
+                cube = np.load(path, mmap_mode="r")
+            else:
+                cube = self.open_cube(scan)
+            if spectra and cube.shape[-1] != len(spectra[0]):
+                raise ValueError(f"{scan['name']} has {cube.shape[-1]} bands, earlier scans have "
+                                 f"{len(spectra[0])}; pass band_set to compare resampled cubes")
+            roi = cube[y0:y1, x0:x1, :]
+            spectra.append(roi.reshape(-1, roi.shape[-1]).mean(axis=0, dtype=np.float64))
+            times.append(scan["scan_time"])
+        if not spectra:
+            return np.empty(0), np.empty((0, 0), dtype=np.float32)
+        return np.array(times), np.stack(spectra).astype(np.float32)
+
+    def pixel_series(self, x, y, start=None, end=None, band_set=None):
+        """Spectrum of one pixel for every scan in a time range."""
+        return self.roi_series(x, y, x + 1, y + 1, start, end, band_set)
+
+
+def _epoch(t, default):
+    if t is None:
+        return default
+    if isinstance(t, datetime.datetime):
+        return t.timestamp()
+    return float(t)
+
+
+if __name__ == "__main__":
+    catalog = ScanCatalog()
+    print(f"Indexed {catalog.refresh()} scan folder(s) in {catalog.db_path}")
+    for scan in catalog.between():
+        when = datetime.datetime.fromtimestamp(scan["scan_time"]).isoformat(sep=" ")
+        print(f"{when}  {scan['name']}  frames={scan['n_frames']}  cube={'yes' if scan['cube_path'] else 'no'}")
@@ -4,11 +4,11 @@ BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 if BASE_DIR not in sys.path:
     sys.path.insert(0, BASE_DIR)
 import json
-import cv2
 import numpy as np
-from pyueye import ueye
 from time import sleep
-from edge.camera_control import Camera 
+from edge.drivers import create_camera
+from utils import config
+from utils.smile import SmileCorrector, find_line_columns, fit_wavelength_map, fit_keystone_map
 
 # --- Parameters ---
 bin_size_x = 8
@@ -52,7 +52,7 @@ def find_peak_band(wavelengths, spectrum, target_range):
 # --- Main Calibration Logic ---
 def run_calibration():
     print("\n🎛 Starting hyperspectral RGB band calibration...\n")
-    cam = Camera()
+    cam = create_camera(load_camera_config())
     cam.connect()
 
     try:
@@ -84,5 +84,48 @@ def run_calibration():
     finally:
         cam.disconnect()
 
+# --- Smile / keystone calibration ---
+def load_camera_config():
+    import yaml
+    with open(os.path.join(BASE_DIR, "edge", "config.yaml"), "r") as f:
+        return yaml.safe_load(f)["camera"]
+
+def run_smile_calibration(line_wavelengths=config.SMILE_LAMP_LINES, feature_rows=None):
+    print("\n🎛 Starting smile/keystone calibration...\n")
+    cam = create_camera(load_camera_config())
+    cam.smile = None  # calibrate on raw frames
+    cam.connect()
+
+    try:
+        input("\n➡️ Point the scanner at the fluorescent reference lamp and press ENTER...")
+        sleep(0.5)
+        lamp = cam.crop_roi(cam.capture_frame()).astype(np.float64)
+
+        centre = lamp[lamp.shape[0] // 2 - 5:lamp.shape[0] // 2 + 5].mean(axis=0)
+        line_columns = find_line_columns(centre, len(line_wavelengths))
+        print(f"Lamp lines found at columns: {line_columns.tolist()}")
+        wavelength_map = fit_wavelength_map(lamp, line_columns, line_wavelengths)
+
+        keystone_map = None
+        if feature_rows:
+            input("\n➡️ Place the wire target across the slit and press ENTER...")
+            sleep(0.5)
+            target = cam.crop_roi(cam.capture_frame()).astype(np.float64)
+            keystone_map = fit_keystone_map(target, feature_rows)
+
+        corrector = SmileCorrector(wavelength_map, keystone_map=keystone_map)
+        corrector.save(config.SMILE_CALIBRATION_FILE)
+
+        smile = wavelength_map[:, wavelength_map.shape[1] // 2]
+        print("\n✅ Smile calibration complete!")
+        print(f"Centre-column smile: {smile.max() - smile.min():.2f} nm across {len(smile)} rows")
+        print(f"Saved to {config.SMILE_CALIBRATION_FILE}")
+
+    finally:
+        cam.disconnect()
+
 if __name__ == "__main__":
-    run_calibration()
+    if len(sys.argv) > 1 and sys.argv[1] == "smile":
+        run_smile_calibration(feature_rows=[int(r) for r in sys.argv[2:]] or None)
+    else:
+        run_calibration()
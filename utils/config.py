@@ -9,6 +9,8 @@ import json
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, "data")
 CALIBRATION_FILE = os.path.join(BASE_DIR, "calibration.json")
+SMILE_CALIBRATION_FILE = os.path.join(BASE_DIR, "smile_calibration.npz")
+SRF_CACHE_DIR = os.path.join(DATA_DIR, "srf_cache")
 
 # -------------------------
 # Camera Settings
@@ -48,6 +50,8 @@ SCAN_END_Z = 80
 STEP_SIZE_X = 10
 STEP_SIZE_Z = 0.2
 PAUSE_AFTER_MOVE = 0.5  # seconds
+JOURNAL_FSYNC_EVERY = 16  # frames made durable per batch
+MAX_SCAN_RETRIES = 3  # reconnect-and-resume attempts after a failure
 
 # -------------------------
 # Processing Settings
@@ -72,6 +76,12 @@ CROP_Y_END = 845
 CROP_X_START = 0
 CROP_X_END = 1936
 
+# Memory for one tile (plus temporaries) in server-side out-of-core processing
+TILE_MEMORY_BUDGET_MB = 256
+
+# Emission lines (nm) of the fluorescent reference lamp used for smile calibration
+SMILE_LAMP_LINES = [404.7, 435.8, 487.7, 546.1, 611.6]
+
 # Perspective correction
 PERSPECTIVE_SCALE_Y = 0.6
 
@@ -0,0 +1,240 @@
+# utils/frame_codec.py
+
+import io
+import os
+import struct
+import numpy as np
+
+# ----------------------------------------------------------------
+#  Frame codecs
+# ----------------------------------------------------------------
+# Lossless encoders for single line frames (rows, bands), uint8 or uint16
+# (12-bit sensor data is stored in uint16). Encoders return bytes; the file
+# extension tells read_frame() how to decode.
+#
+#   raw         .npy   no compression, fastest to write
+#   png         .png   8/16-bit PNG with a selectable zlib level
+#   tiff        .tiff  8/16-bit TIFF, LZW or uncompressed
+#   delta-zstd  .kfd   difference to the previous frame of the scan + zstd
+#   delta-lz4   .kfd   difference to the previous frame of the scan + lz4
+#
+# Consecutive frames of a scan are very similar, so the delta codecs store
+# the (wrap-around, hence lossless) difference to the previous frame, with a keyframe every
+# `keyframe_interval` frames. Each delta file names its reference frame, so
+# any frame can be decoded on its own by walking back to the last keyframe.
+
+FRAME_EXTENSIONS = (".png", ".tiff", ".npy", ".kfd")
+
+_KFD_MAGIC = b"KFD1"
+_KFD_HEADER = struct.Struct("<4sBBBBII")  # magic, kind, dtype, compressor, level, rows, cols
+_KIND_KEY, _KIND_DELTA = 0, 1
+_DTYPES = {1: np.uint8, 2: np.uint16}
+_COMPRESSORS = {"zstd": 1, "lz4": 2}
+
+
+def _cv2():
+    import cv2
+    return cv2
+
+
+class RawEncoder:
+    name = "raw"
+    extension = ".npy"
+
+    def encode(self, frame, path=None):
+        buf = io.BytesIO()
+        np.save(buf, frame, allow_pickle=False)
+        return buf.getvalue()
+
+    def reset(self):
+        pass
+
+
+class PngEncoder:
+    name = "png"
+    extension = ".png"
+
+    def __init__(self, level=1):
+        self.level = level
+
+    def encode(self, frame, path=None):
+        cv2 = _cv2()
+        ok, buf = cv2.imencode(".png", frame, [cv2.IMWRITE_PNG_COMPRESSION, self.level])
+        if not ok:
+            raise RuntimeError("PNG encoding failed")
+        return buf.tobytes()
+
+    def reset(self):
+        pass
+
+
+class TiffEncoder:
+    name = "tiff"
+    extension = ".tiff"
+
+    def __init__(self, lzw=True):
+        self.lzw = lzw
+
+    def encode(self, frame, path=None):
+        cv2 = _cv2()
+        ok, buf = cv2.imencode(".tiff", frame, [cv2.IMWRITE_TIFF_COMPRESSION, 5 if self.lzw else 1])
+        if not ok:
+            raise RuntimeError("TIFF encoding failed")
+        return buf.tobytes()
+
+    def reset(self):
+        pass
+
+
+def _compressor(name, level):
+    if name == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("delta-zstd codec needs the 'zstandard' package (pip install zstandard)")
+        return zstandard.ZstdCompressor(level=level).compress
+    try:
+        import lz4.frame
+    except ImportError:
+        raise ImportError("delta-lz4 codec needs the 'lz4' package (pip install lz4)")
+    return lambda data: lz4.frame.compress(data, compression_level=level)
+
+
+def _decompressor(code):
+    if code == _COMPRESSORS["zstd"]:
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress
+    import lz4.frame
+    return lz4.frame.decompress
+
+
+class DeltaEncoder:
+    extension = ".kfd"
+
+    def __init__(self, compressor="zstd", level=1, keyframe_interval=32):
+        self.name = f"delta-{compressor}"
+        self.compressor = compressor
+        self.level = level
+        self.keyframe_interval = keyframe_interval
+        self._compress = _compressor(compressor, level)
+        self.reset()
+
+    def reset(self):
+        """Start a new chain; the next frame is a keyframe."""
+        self._previous = None
+        self._previous_name = None
+        self._since_key = 0
+
+    def encode(self, frame, path=None):
+        """
+        Encode `frame`. `path` is the file the bytes will be written to; its
+        name is recorded by the next delta frame as the reference.
+        """
+        if frame.dtype not in (np.uint8, np.uint16):
+            raise ValueError(f"Unsupported frame dtype {frame.dtype}")
+        is_key = (self._previous is None or self._previous.shape != frame.shape
+                  or self._previous.dtype != frame.dtype or self._since_key >= self.keyframe_interval)
+
+        if is_key:
+            kind, payload, ref = _KIND_KEY, np.ascontiguousarray(frame).tobytes(), b""
+            self._since_key = 0
+        else:
+            delta = np.subtract(frame, self._previous, dtype=frame.dtype)
+            kind, payload, ref = _KIND_DELTA, delta.tobytes(), self._previous_name.encode()
+            self._since_key += 1
+
+        dtype_code = 1 if frame.dtype == np.uint8 else 2
+        header = _KFD_HEADER.pack(_KFD_MAGIC, kind, dtype_code, _COMPRESSORS[self.compressor],
+                                  self.level, frame.shape[0], frame.shape[1])
+
+        self._previous = frame
+        self._previous_name = os.path.basename(path) if path else None
+        if self._previous_name is None:
+            # Without a file name a delta could never be decoded on its own
+            self.reset()
+
+        return header + struct.pack("<H", len(ref)) + ref + self._compress(payload)
+
+
+ENCODERS = {
+    "raw": RawEncoder,
+    "png": PngEncoder,
+    "tiff": TiffEncoder,
+    "delta-zstd": lambda **kw: DeltaEncoder("zstd", **kw),
+    "delta-lz4": lambda **kw: DeltaEncoder("lz4", **kw),
+}
+
+
+def get_encoder(name="png", **options):
+    """Create a frame encoder by name (see ENCODERS)."""
+    if name not in ENCODERS:
+        raise ValueError(f"Unknown frame codec '{name}', expected one of {sorted(ENCODERS)}")
+    return ENCODERS[name](**options)
+
+
+def encoder_from_config(camera_cfg):
+    """Frame encoder selected by the FRAME_CODEC / FRAME_COMPRESSION camera settings."""
+    name = camera_cfg.get("FRAME_CODEC", "png")
+    options = {}
+    if camera_cfg.get("FRAME_COMPRESSION") is not None and name in ("png", "delta-zstd", "delta-lz4"):
+        options["level"] = camera_cfg["FRAME_COMPRESSION"]
+    return get_encoder(name, **options)
+
+
+def write_frame(path, frame, encoder):
+    """
+    Encode and write one frame. The extension of `path` is replaced by the
+    encoder's extension.
+
+    Returns:
+        The path written
+    """
+    path = os.path.splitext(path)[0] + encoder.extension
+    data = encoder.encode(frame, path)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def read_frame(path, cache=None, cache_size=2):
+    """
+    Decode a frame file written by any of the codecs.
+
+    Pass the same `cache` dict when reading a scan in order, so each delta
+    frame only decodes one new frame. Frames read against the capture order
+    (reversed serpentine rows) need a `cache_size` of at least one row.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".npy":
+        return np.load(path, allow_pickle=False)
+    if ext != ".kfd":
+        cv2 = _cv2()
+        return cv2.imread(path, cv2.IMREAD_UNCHANGED)
+
+    cache = {} if cache is None else cache
+    if path in cache:
+        return cache[path]
+
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, kind, dtype_code, comp, _, rows, cols = _KFD_HEADER.unpack_from(data)
+    if magic != _KFD_MAGIC:
+        raise ValueError(f"{path} is not a KFD frame")
+    offset = _KFD_HEADER.size
+    (ref_len,) = struct.unpack_from("<H", data, offset)
+    offset += 2
+    ref = data[offset:offset + ref_len].decode()
+    payload = _decompressor(comp)(data[offset + ref_len:])
+
+    dtype = _DTYPES[dtype_code]
+    if kind == _KIND_KEY:
+        frame = np.frombuffer(payload, dtype=dtype).reshape(rows, cols)
+    else:
+        previous = read_frame(os.path.join(os.path.dirname(path), ref), cache, cache_size)
+        delta = np.frombuffer(payload, dtype=dtype).reshape(rows, cols)
+        frame = np.add(previous, delta, dtype=dtype)
+
+    cache[path] = frame
+    while len(cache) > cache_size:
+        cache.pop(next(iter(cache)))
+    return frame
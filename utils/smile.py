@@ -0,0 +1,249 @@
+# utils/smile.py
+
+import os
+import numpy as np
+
+# ----------------------------------------------------------------
+#  Smile / keystone correction
+# ----------------------------------------------------------------
+# Frames coming off the line-scan spectrograph are (rows, columns) with the
+# spatial axis along the rows and the spectral axis along the columns.
+# Smile: the wavelength seen by a column changes from row to row.
+# Keystone: the spatial position seen by a row changes from column to column.
+#
+# Both are fixed properties of the optics, so the resampling weights are
+# computed once from the calibration maps and every frame is corrected with a
+# single gather + weighted sum over a fixed number of taps per output pixel.
+
+TAPS = 4  # bilinear: 2 spectral x 2 spatial neighbours
+
+
+class SmileCorrector:
+    def __init__(self, wavelength_map, target_wavelengths=None, keystone_map=None):
+        """
+        Precompute sparse resampling weights for smile/keystone correction.
+
+        Parameters:
+            wavelength_map: np.ndarray (H, W), wavelength (nm) seen by each pixel
+            target_wavelengths: wavelengths of the corrected columns
+                (defaults to the centre row of the wavelength map)
+            keystone_map: optional np.ndarray (H, W), spatial offset in rows of
+                each pixel relative to the reference column
+        """
+        self.wavelength_map = np.asarray(wavelength_map, dtype=np.float64)
+        if self.wavelength_map.ndim != 2:
+            raise ValueError("wavelength_map must be 2D (rows, columns)")
+        h, w = self.wavelength_map.shape
+
+        if target_wavelengths is None:
+            target_wavelengths = self.wavelength_map[h // 2]
+        self.target_wavelengths = np.asarray(target_wavelengths, dtype=np.float64)
+
+        if keystone_map is not None:
+            keystone_map = np.asarray(keystone_map, dtype=np.float64)
+            if keystone_map.shape != (h, w):
+                raise ValueError(f"keystone_map shape {keystone_map.shape} != wavelength_map shape {(h, w)}")
+        self.keystone_map = keystone_map
+
+        self.index, self.weights = self._build_weights()
+
+    @property
+    def input_shape(self):
+        return self.wavelength_map.shape
+
+    @property
+    def output_shape(self):
+        return self.wavelength_map.shape[0], self.target_wavelengths.shape[0]
+
+    def _build_weights(self):
+        h, w = self.wavelength_map.shape
+        columns = np.arange(w, dtype=np.float64)
+
+        # Fractional source column of every target wavelength, row by row
+        col = np.empty((h, self.target_wavelengths.shape[0]))
+        for r in range(h):
+            wl = self.wavelength_map[r]
+            if wl[0] > wl[-1]:
+                col[r] = np.interp(self.target_wavelengths, wl[::-1], columns[::-1])
+            else:
+                col[r] = np.interp(self.target_wavelengths, wl, columns)
+
+        c0 = np.clip(np.floor(col).astype(np.int64), 0, w - 2)
+        wc = np.clip(col - c0, 0.0, 1.0)
+        c1 = c0 + 1
+
+        rows = np.arange(h, dtype=np.float64)[:, None]
+        index = np.empty(col.shape + (TAPS,), dtype=np.int64)
+        weights = np.empty(col.shape + (TAPS,), dtype=np.float32)
+
+        for k, (c, w_spec) in enumerate(((c0, 1.0 - wc), (c1, wc))):
+            if self.keystone_map is None:
+                y = np.broadcast_to(rows, c.shape)
+            else:
+                y = rows + np.take_along_axis(self.keystone_map, c, axis=1)
+            y0 = np.clip(np.floor(y).astype(np.int64), 0, h - 2)
+            wy = np.clip(y - y0, 0.0, 1.0)
+
+            index[..., 2 * k] = y0 * w + c
+            index[..., 2 * k + 1] = (y0 + 1) * w + c
+            weights[..., 2 * k] = w_spec * (1.0 - wy)
+            weights[..., 2 * k + 1] = w_spec * wy
+
+        return index.reshape(-1, TAPS), weights.reshape(-1, TAPS)
+
+    def apply(self, frame):
+        """
+        Resample a cropped frame onto the straight wavelength/spatial grid.
+
+        Parameters:
+            frame: np.ndarray of shape (H, W), same ROI as the calibration
+
+        Returns:
+            Corrected frame of shape (H, len(target_wavelengths)), same dtype
+        """
+        if frame.shape != self.input_shape:
+            raise ValueError(f"Frame shape {frame.shape} does not match calibration {self.input_shape}")
+
+        flat = frame.reshape(-1)
+        out = np.einsum("nk,nk->n", flat[self.index], self.weights, dtype=np.float32)
+        out = out.reshape(self.output_shape)
+
+        if np.issubdtype(frame.dtype, np.integer):
+            info = np.iinfo(frame.dtype)
+            return np.clip(np.rint(out), info.min, info.max).astype(frame.dtype)
+        return out.astype(frame.dtype)
+
+    def save(self, path):
+        """Store the calibration maps together with the precomputed weights."""
+        arrays = {
+            "wavelength_map": self.wavelength_map,
+            "target_wavelengths": self.target_wavelengths,
+            "index": self.index,
+            "weights": self.weights,
+        }
+        if self.keystone_map is not None:
+            arrays["keystone_map"] = self.keystone_map
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved corrector, reusing the cached weights."""
+        with np.load(path) as data:
+            corrector = cls.__new__(cls)
+            corrector.wavelength_map = data["wavelength_map"]
+            corrector.target_wavelengths = data["target_wavelengths"]
+            corrector.keystone_map = data["keystone_map"] if "keystone_map" in data else None
+            corrector.index = data["index"]
+            corrector.weights = data["weights"]
+        return corrector
+
+
+def load_smile_corrector(path):
+    """Return a SmileCorrector from `path`, or None if no calibration exists yet."""
+    if not path or not os.path.exists(path):
+        return None
+    return SmileCorrector.load(path)
+
+
+# ----------------------------------------------------------------
+#  Calibration fitting
+# ----------------------------------------------------------------
+def _centroids(profile_block, lo):
+    """Intensity-weighted centroid along axis 1 of a (N, window) block."""
+    block = profile_block.astype(np.float64)
+    block = block - block.min(axis=1, keepdims=True)
+    total = block.sum(axis=1)
+    total[total == 0] = 1e-9
+    pos = np.arange(block.shape[1], dtype=np.float64) + lo
+    return (block * pos).sum(axis=1) / total
+
+
+def find_line_columns(profile, n_lines, min_separation=10):
+    """
+    Pick the `n_lines` strongest local maxima of a 1D spectrum.
+
+    Returns:
+        Column indices sorted left to right
+    """
+    profile = np.asarray(profile, dtype=np.float64)
+    is_peak = np.r_[False, (profile[1:-1] > profile[:-2]) & (profile[1:-1] >= profile[2:]), False]
+    candidates = np.where(is_peak)[0]
+    candidates = candidates[np.argsort(profile[candidates])[::-1]]
+
+    picked = []
+    for c in candidates:
+        if all(abs(c - p) >= min_separation for p in picked):
+            picked.append(c)
+        if len(picked) == n_lines:
+            break
+    return np.sort(np.array(picked, dtype=np.int64))
+
+
+def fit_wavelength_map(frame, line_columns, line_wavelengths, window=10, degree=2):
+    """
+    Fit a per-row wavelength map from a frame of an emission-line lamp.
+
+    Parameters:
+        frame: np.ndarray (H, W), cropped lamp frame
+        line_columns: approximate column of each line on the centre row
+        line_wavelengths: wavelength (nm) of each line
+        window: half-width (columns) searched around each line
+        degree: polynomial degree for the column -> wavelength fit
+
+    Returns:
+        np.ndarray (H, W) of wavelengths in nm
+    """
+    h, w = frame.shape
+    line_wavelengths = np.asarray(line_wavelengths, dtype=np.float64)
+    rows = np.arange(h, dtype=np.float64)
+
+    # Line position per row, smoothed with a parabola (smile curve)
+    positions = np.empty((h, len(line_columns)))
+    for j, c in enumerate(line_columns):
+        lo = max(int(c) - window, 0)
+        hi = min(int(c) + window + 1, w)
+        raw = _centroids(frame[:, lo:hi], lo)
+        positions[:, j] = np.polyval(np.polyfit(rows, raw, 2), rows)
+
+    deg = min(degree, len(line_columns) - 1)
+    columns = np.arange(w, dtype=np.float64)
+    wavelength_map = np.empty((h, w))
+    for r in range(h):
+        coeffs = np.polyfit(positions[r], line_wavelengths, deg)
+        wavelength_map[r] = np.polyval(coeffs, columns)
+    return wavelength_map
+
+
+def fit_keystone_map(frame, feature_rows, window=10, degree=2):
+    """
+    Fit a keystone map from a frame of horizontal spatial features
+    (e.g. thin wires across the slit).
+
+    Parameters:
+        frame: np.ndarray (H, W), cropped frame
+        feature_rows: approximate row of each feature at the centre column
+        window: half-height (rows) searched around each feature
+        degree: polynomial degree of the per-feature offset along columns
+
+    Returns:
+        np.ndarray (H, W), row offset of each pixel relative to the centre column
+    """
+    h, w = frame.shape
+    columns = np.arange(w, dtype=np.float64)
+    feature_rows = sorted(int(r) for r in feature_rows)
+
+    offsets = np.empty((len(feature_rows), w))
+    centres = np.empty(len(feature_rows))
+    for j, r in enumerate(feature_rows):
+        lo = max(r - window, 0)
+        hi = min(r + window + 1, h)
+        raw = _centroids(frame[lo:hi, :].T, lo)
+        smooth = np.polyval(np.polyfit(columns, raw, degree), columns)
+        centres[j] = smooth[w // 2]
+        offsets[j] = smooth - centres[j]
+
+    rows = np.arange(h, dtype=np.float64)
+    keystone_map = np.empty((h, w))
+    for c in range(w):
+        keystone_map[:, c] = np.interp(rows, centres, offsets[:, c])
+    return keystone_map